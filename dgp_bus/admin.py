@@ -56,7 +56,9 @@ class PatientAdmin(admin.ModelAdmin):
         'default_accommodation',
         'created_at',
     )
-    search_fields = ('name', 'last_name', 'phone_no', 'room')
+    # prefix and exact matches on indexed columns; the term is folded like the search_* columns
+    # names folded like the search_* columns; room and phone number as typed
+    search_fields = ('search_name__folded_prefix', 'search_last_name__folded_prefix', '=room', '=phone_no')
     # include default_accommodation here only if present on model:
     list_filter = ('default_accommodation',)
     ordering = ('name', 'last_name')
@@ -88,10 +90,8 @@ class AppointmentAdmin(admin.ModelAdmin):
         'hospital', 'accommodation', 'appointment_date',
         'translator', 'has_taxi', 'status', 'wheelchair', 'trolley', 'companion',
     )
-    search_fields = (
-        'patient__name', 'patient__last_name', 'patient__room',
-        'department', 'description',
-    )
+    # indexed patient columns only; a '%term%' on department/description would scan every appointment
+    search_fields = ('patient__search_name__folded_prefix', 'patient__search_last_name__folded_prefix', '=patient__room')
     ordering = ('appointment_date', 'appointment_time')
     readonly_fields = ('created_at',)
     autocomplete_fields = ('patient', 'hospital', 'accommodation')
@@ -7,3 +7,4 @@ class DgpBusConfig(AppConfig):
     def ready(self):
         # Import your Celery task module here so it's registered after the app registry is ready
         from . import taxi_email
+        from . import signals
@@ -0,0 +1,153 @@
+# dgp_bus/archive.py
+"""
+Cold storage for past appointments.
+
+Appointments older than APPOINTMENT_ARCHIVE_AFTER_DAYS are moved, a bounded batch
+at a time, into gzip JSONL files partitioned by date:
+
+    <APPOINTMENT_ARCHIVE_DIR>/YYYY/MM/YYYY-MM-DD.jsonl.gz
+
+Each batch is appended as its own gzip member and flushed to disk before the rows
+are deleted, so an interrupted run only leaves rows that the next run archives
+again. Readers keep the last copy of a duplicated id.
+"""
+import gzip
+import json
+import os
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Min
+
+from .models import Appointment, Patient
+from .revisions import bump_revisions, day_scope
+from .ridership import rollup_ridership
+
+# the appointment's own columns only: the archive is kept after tasks.delete_expired_entries
+# purges the patient, so it must not carry names or rooms
+ARCHIVE_FIELDS = (
+    'id', 'patient_id', 'hospital_id', 'accommodation_id', 'appointment_date', 'appointment_time',
+    'bus_time_manual', 'bus_time_computed',
+    'status', 'translator', 'has_taxi', 'wheelchair', 'trolley', 'companion',
+    'department', 'departure_location',
+)
+
+
+def day_path(day):
+    root = Path(settings.APPOINTMENT_ARCHIVE_DIR)
+    return root / f'{day:%Y}' / f'{day:%m}' / f'{day:%Y-%m-%d}.jsonl.gz'
+
+
+def _members(data):
+    """Decompressed gzip members of `data` and the length of its intact prefix."""
+    members, offset = [], 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            member = decompressor.decompress(data[offset:])
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break
+        members.append(member)
+        offset = len(data) - len(decompressor.unused_data)
+    return members, offset
+
+
+def _append_batch(day, rows):
+    path = day_path(day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = gzip.compress(''.join(json.dumps(r, cls=DjangoJSONEncoder) + '\n' for r in rows).encode())
+    with open(path, 'ab+') as file:
+        # drop a member truncated by an interrupted run; its rows are still in the table
+        file.seek(0)
+        _, intact = _members(file.read())
+        file.truncate(intact)
+        file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def export_day(day, queryset=None, batch_size=None):
+    """Append all of `day`'s appointments to the archive without deleting them."""
+    batch_size = batch_size or settings.APPOINTMENT_ARCHIVE_BATCH_SIZE
+    rows = (queryset if queryset is not None else Appointment.objects).filter(appointment_date=day).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id).values(*ARCHIVE_FIELDS)[:batch_size])
+        if not batch:
+            return
+        _append_batch(day, batch)
+        last_id = batch[-1]['id']
+
+
+def archive_appointments(older_than_days=None, batch_size=None, max_batches=None):
+    """
+    Move appointments dated before today - `older_than_days` to the archive, oldest first.
+    Stops after `max_batches` batches (None: until done). Returns the number of rows moved.
+    """
+    older_than_days = settings.APPOINTMENT_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or settings.APPOINTMENT_ARCHIVE_BATCH_SIZE
+    cutoff = date.today() - timedelta(days=older_than_days)
+
+    # the rollup must see the rows before they leave the hot table
+    rollup_ridership()
+
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        day = Appointment.objects.filter(appointment_date__lt=cutoff).aggregate(day=Min('appointment_date'))['day']
+        if day is None:
+            break
+        rows = list(
+            Appointment.objects
+            .filter(appointment_date=day)
+            .order_by('id')
+            .values(*ARCHIVE_FIELDS)[:batch_size]
+        )
+        _append_batch(day, rows)
+        Appointment.objects.filter(pk__in=[r['id'] for r in rows]).delete()
+        moved += len(rows)
+        batches += 1
+    return moved
+
+
+def _read_day(path):
+    records = {}
+    members, _ = _members(path.read_bytes())
+    for member in members:
+        for line in member.decode().splitlines():
+            record = json.loads(line)
+            records[record['id']] = record
+    return records.values()
+
+
+def read_archive(start, end):
+    """Archived appointment records dated start..end, in date order."""
+    day = start
+    while day <= end:
+        path = day_path(day)
+        if path.exists():
+            yield from sorted(_read_day(path), key=lambda r: (r['appointment_time'], r['id']))
+        day += timedelta(days=1)
+
+
+def restore_appointments(start, end):
+    """
+    Put archived appointments dated start..end back into the hot table.
+    Rows still present and rows whose patient has since been deleted are skipped.
+    Returns (restored, skipped).
+    """
+    records = list(read_archive(start, end))
+    existing = set(Appointment.objects.filter(pk__in=[r['id'] for r in records]).values_list('id', flat=True))
+    patients = set(Patient.objects.filter(pk__in={r['patient_id'] for r in records}).values_list('id', flat=True))
+
+    restorable = [r for r in records if r['id'] not in existing and r['patient_id'] in patients]
+    Appointment.objects.bulk_create(
+        [Appointment(**{f: r[f] for f in ARCHIVE_FIELDS}) for r in restorable],
+        batch_size=500,
+    )
+    bump_revisions('appointments', *{day_scope('appointments', r['appointment_date']) for r in restorable})
+    return len(restorable), len(records) - len(restorable)
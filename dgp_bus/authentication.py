@@ -0,0 +1,76 @@
+# dgp_bus/authentication.py
+"""
+Stateless JWT authentication.
+
+Access tokens carry the account claims permissions need (user_type, role, is_staff,
+is_active), so request.user is built from the signed token instead of a user-table
+query. Revocation goes through the cache (Redis): a denylist of token ids and a
+per-account "revoked before" timestamp, both read with one get_many per request.
+Tokens issued before the claims existed still authenticate through the database.
+"""
+import time
+
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import SiteUser
+
+DENY_PREFIX = 'jwt-deny:'
+REVOKED_PREFIX = 'jwt-revoked-before:'
+
+
+def account_claims(user):
+    if isinstance(user, SiteUser):
+        return {'user_type': 'site', 'role': 'frontdesk' if user.is_frontdesk else 'site',
+                'is_staff': False, 'is_active': user.is_active}
+    return {'user_type': 'staff', 'role': user.role, 'is_staff': user.is_staff, 'is_active': user.is_active}
+
+
+def _revoked_key(user_type, user_id):
+    return f'{REVOKED_PREFIX}{user_type}:{user_id}'
+
+
+def check_revoked(token):
+    """Raise AuthenticationFailed if `token` was revoked, alone or with all of its account's tokens."""
+    deny_key = DENY_PREFIX + str(token['jti'])
+    revoked_key = _revoked_key(token.get('user_type'), token.get(api_settings.USER_ID_CLAIM))
+    found = cache.get_many([deny_key, revoked_key])
+    if deny_key in found or found.get(revoked_key, 0) >= token['iat']:
+        raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+
+
+def revoke_token(token):
+    """Deny one token until it would have expired anyway."""
+    remaining = int(token['exp'] - time.time())
+    if remaining > 0:
+        cache.set(DENY_PREFIX + str(token['jti']), True, timeout=remaining)
+
+
+def revoke_account(user):
+    """Deny every token issued to `user` up to now."""
+    user_type = account_claims(user)['user_type']
+    lifetime = api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+    # iat has whole-second resolution; tokens issued within this second are revoked too
+    cache.set(_revoked_key(user_type, user.pk), int(time.time()), timeout=int(lifetime))
+
+
+class AccountTokenUser(TokenUser):
+    """request.user for claim-bearing tokens; role, user_type etc. read through to the claims."""
+
+    @property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+
+class TokenClaimsAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        check_revoked(validated_token)
+        if 'user_type' not in validated_token:
+            # issued before tokens carried claims: look the account up as before
+            return super().get_user(validated_token)
+        if not validated_token.get('is_active'):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return AccountTokenUser(validated_token)
@@ -1,20 +1,82 @@
-from django.contrib.auth.backends import BaseBackend
-from dgp_bus.models import SiteUser
+import hashlib
 
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F, IntegerField, Value
+from dgp_bus.models import SiteUser, StaffAdminUser
 
-class SiteUserBackend(BaseBackend):
-    def authenticate(self, request, email=None, password=None, **kwargs):
-        try:
-            user = SiteUser.objects.get(email=email)
-            if not user.is_active:  # Check if the user is approved
-                return None
-            if user.check_password(password):
-                return user
-        except SiteUser.DoesNotExist:
+# checked in this order, as the old ModelBackend -> SiteUserBackend chain did
+ACCOUNT_MODELS = (StaffAdminUser, SiteUser)
+
+# every column of both tables, so the UNION returns whole accounts; a table without one selects NULL
+ACCOUNT_COLUMNS = {}
+for _model in ACCOUNT_MODELS:
+    for _field in _model._meta.concrete_fields:
+        ACCOUNT_COLUMNS.setdefault(_field.attname, _field)
+
+
+def negative_cache_key(email):
+    return 'auth-miss:' + hashlib.sha256(email.encode()).hexdigest()
+
+
+def _rehash(user):
+    # check_password calls this when the stored hash uses outdated hasher settings
+    def setter(raw_password):
+        user.set_password(raw_password)
+        user.save(update_fields=['password'])
+    return setter
+
+
+def _account_rows(model, kind, email):
+    names = {f.attname for f in model._meta.concrete_fields}
+    columns = {
+        f'account_{name}': F(name) if name in names else Value(None, output_field=field.__class__())
+        for name, field in ACCOUNT_COLUMNS.items()
+    }
+    return (
+        model.objects.filter(email=email)
+        .annotate(kind=Value(kind, output_field=IntegerField()), **columns)
+        .values_list('kind', *columns)
+    )
+
+
+class AccountBackend(ModelBackend):
+    """
+    Log in staff and site users by email with one indexed UNION query over both tables;
+    the user is built from the row it returns.
+
+    Unknown emails are remembered for AUTH_NEGATIVE_CACHE_TIMEOUT seconds (cleared when an
+    account with that email is saved) and always cost one password hash, so a login takes
+    as long whether or not the account exists. Sessions are staff-only (the admin), so
+    get_user stays ModelBackend's single StaffAdminUser lookup.
+    """
+
+    def authenticate(self, request, email=None, password=None, username=None, **kwargs):
+        email = email or username  # the admin login form sends `username`
+        if not email or password is None:
             return None
 
-    def get_user(self, user_id):
-        try:
-            return SiteUser.objects.get(pk=user_id)
-        except SiteUser.DoesNotExist:
+        rows = []
+        if not cache.get(negative_cache_key(email)):
+            candidates = [_account_rows(model, i, email) for i, model in enumerate(ACCOUNT_MODELS)]
+            rows = list(candidates[0].union(*candidates[1:], all=True).order_by('kind'))
+            if not rows:
+                cache.set(negative_cache_key(email), True, timeout=settings.AUTH_NEGATIVE_CACHE_TIMEOUT)
+
+        if not rows:
+            # same cost as a real check (cf. ModelBackend's dummy set_password)
+            make_password(password)
             return None
+
+        for kind, *values in rows:
+            model = ACCOUNT_MODELS[kind]
+            row = dict(zip(ACCOUNT_COLUMNS, values))
+            field_names = [f.attname for f in model._meta.concrete_fields]
+            user = model.from_db(DEFAULT_DB_ALIAS, field_names, [row[name] for name in field_names])
+            # hash first, so inactive accounts cost the same as active ones
+            if check_password(password, user.password, setter=_rehash(user)) and user.is_active:
+                return user
+        return None
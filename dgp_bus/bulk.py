@@ -0,0 +1,117 @@
+# dgp_bus/bulk.py
+"""
+Bulk appointment create/update for the coordinators' flight lists.
+
+Every item is validated by AppointmentSerializer, but the referenced rows are loaded
+up front: patients (and the appointments being updated) with one query each, hospitals
+and accommodations from the reference cache. Bus times come from the cached timetable
+snapshot. The valid rows are then written with bulk_create/bulk_update in one
+transaction. bulk_create sends no post_save signals, so the ride manifest refresh and
+revision bumps of dgp_bus.signals are done here, once for the whole batch.
+
+Backends that can't return ids from a multi-row INSERT (MySQL) get them from one
+read of the new rows in the same transaction, matched on their values.
+"""
+from collections import defaultdict
+from operator import attrgetter
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .models import Appointment, Patient
+from .revisions import bump_revisions, day_scope
+from .rides import schedule_ride_refresh
+from .serializers import AppointmentSerializer, parse_pk
+
+BATCH_SIZE = 500
+
+
+def _pks(model, values):
+    return {pk for pk in (parse_pk(model, v) for v in values) if pk is not None}
+
+
+def _read_back_ids(created):
+    """Set the ids of appointments bulk_create inserted without getting them back."""
+    fields = [f.attname for f in Appointment._meta.concrete_fields if not f.primary_key]
+    key = attrgetter(*fields)
+    pending = defaultdict(list)
+    for instance in created:
+        pending[key(instance)].append(instance)
+    # created_at differs per row; rows equal in every field are interchangeable
+    rows = (Appointment.objects
+            .filter(patient_id__in={i.patient_id for i in created}, created_at__gte=min(i.created_at for i in created))
+            .order_by('id').values_list('id', *fields))
+    for pk, *values in rows:
+        matches = pending.get(tuple(values))
+        if matches:
+            matches.pop(0).pk = pk
+    if any(matches for matches in pending.values()):
+        raise DatabaseError('Could not read back the ids of the created appointments.')
+
+
+def save_appointments(items, atomic=False):
+    """
+    Validate and save a list of appointment dicts; an item with an `id` updates that
+    appointment. Returns (results, ok), one result per item in order: {'status': 201 or
+    200, 'appointment': data} or {'status': 400, 'errors': ...}. With `atomic`, nothing
+    is written unless every item is valid (the valid ones get status 424).
+    """
+    items = [item if isinstance(item, dict) else {} for item in items]
+    existing = (
+        Appointment.objects.select_related('patient', 'hospital', 'accommodation')
+        .in_bulk(_pks(Appointment, (item['id'] for item in items if 'id' in item)))
+    )
+    patient_pks = _pks(Patient, (item.get('patient_id') for item in items))
+    patients = Patient.objects.in_bulk(patient_pks)
+    # unknown ids as None, so invalid items don't query one by one
+    context = {'prefetched': {Patient: {pk: patients.get(pk) for pk in patient_pks}}}
+
+    results, created, updated, fields, days = [], [], [], set(), set()
+    for item in items:
+        instance = None
+        if 'id' in item:
+            instance = existing.get(parse_pk(Appointment, item['id']))
+            if instance is None:
+                results.append({'status': 400, 'errors': {'id': ['Appointment not found.']}})
+                continue
+        serializer = AppointmentSerializer(instance, data=item, partial=instance is not None, context=context)
+        if not serializer.is_valid():
+            results.append({'status': 400, 'errors': serializer.errors})
+            continue
+
+        validated = serializer.with_bus_time(instance, dict(serializer.validated_data))
+        if instance is None:
+            instance = Appointment(**validated)
+            created.append(instance)
+            results.append({'status': 201, 'appointment': instance})
+        else:
+            days.add(instance.appointment_date)
+            for field, value in validated.items():
+                setattr(instance, field, value)
+            fields.update(validated)
+            updated.append(instance)
+            results.append({'status': 200, 'appointment': instance})
+        days.add(instance.appointment_date)
+
+    ok = all(r['status'] != 400 for r in results)
+    if atomic and not ok:
+        skipped = {'status': 424, 'errors': {'non_field_errors': ['Not saved: other items are invalid.']}}
+        return [r if r['status'] == 400 else skipped for r in results], False
+
+    with transaction.atomic():
+        Appointment.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        if created and not connection.features.can_return_rows_from_bulk_insert:
+            _read_back_ids(created)
+        if updated:
+            now = timezone.now()
+            for instance in updated:
+                instance.updated_at = now
+            Appointment.objects.bulk_update(updated, [*fields, 'updated_at'], batch_size=BATCH_SIZE)
+        if created or updated:
+            bump_revisions('appointments', *(day_scope('appointments', day) for day in days))
+            schedule_ride_refresh(*days)
+
+    for result in results:
+        if 'appointment' in result:
+            result['appointment'] = AppointmentSerializer(result['appointment']).data
+    return results, ok
@@ -0,0 +1,104 @@
+# dgp_bus/checkin.py
+"""
+Check-in and taxi flags written as single UPDATE statements.
+
+The desk clients used to read the appointment and save it back, so two clerks tapping
+at once could undo each other. Here the database does the change: a flag is set to the
+value the clerk asked for (or flipped, for older clients), and a bulk check-in marks a
+list of appointments or a whole departure in one statement. UPDATEs send no post_save,
+so the revision bumps and ride manifest refresh of dgp_bus.signals are done here.
+"""
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Appointment
+from .revisions import bump_revisions, day_scope
+from .rides import schedule_ride_refresh
+
+
+def _rows_changed(*days):
+    bump_revisions('appointments', *(day_scope('appointments', day) for day in days))
+    schedule_ride_refresh(*days)
+
+
+def _update_returning(pk, field, value, now):
+    """
+    (value afterwards, appointment_date, changed?) from one UPDATE ... RETURNING, or None
+    if there is no such appointment.
+    """
+    qn = connection.ops.quote_name
+    column, updated_at = qn(Appointment._meta.get_field(field).column), qn('updated_at')
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    if value is None:
+        assignments, params = f'{column} = NOT {column}, {updated_at} = %s', [stamp]
+    else:
+        # already set (e.g. by another clerk) is not a change; updated_at stays, so delta sync skips it
+        assignments = f'{column} = %s, {updated_at} = CASE WHEN {column} = %s THEN {updated_at} ELSE %s END'
+        params = [value, value, stamp]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {qn(Appointment._meta.db_table)} SET {assignments} WHERE {qn("id")} = %s '
+            f'RETURNING {column}, {qn("appointment_date")}, {updated_at} = %s',
+            [*params, pk, stamp],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return bool(row[0]), Appointment._meta.get_field('appointment_date').to_python(row[1]), bool(row[2])
+
+
+def set_flag(pk, field, value=None):
+    """
+    Set a boolean field of one appointment to `value`, or flip it when `value` is None.
+    Returns the field's value afterwards, or None if there is no such appointment.
+
+    One UPDATE ... RETURNING on SQLite and PostgreSQL. MySQL has no RETURNING for UPDATE,
+    so there a flip reads the new value back, and an explicit set reads the day only when
+    it changed something (for the revision bump) or checks that the appointment exists
+    when it didn't.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if connection.vendor in ('sqlite', 'postgresql'):
+            row = _update_returning(pk, field, value, now)
+            if row is None:
+                return None
+            value, day, changed = row
+        else:
+            qs = Appointment.objects.filter(pk=pk)
+            if value is None:
+                changed = qs.update(**{field: ~F(field), 'updated_at': now})
+                # the UPDATE holds the row lock, so this reads our own write
+                row = qs.values_list(field, 'appointment_date').first()
+                if row is None:
+                    return None
+                value, day = row
+            else:
+                changed = qs.exclude(**{field: value}).update(**{field: value, 'updated_at': now})
+                if changed:
+                    day = qs.values_list('appointment_date', flat=True).first()
+                elif not qs.exists():
+                    return None
+        if changed:
+            _rows_changed(day)
+    return value
+
+
+def check_in(status=True, ids=None, day=None, departure_time=None):
+    """
+    Set `status` on the appointments `ids`, or on everyone riding the bus that leaves at
+    `departure_time` on `day` (taxi passengers excluded). Returns the number changed.
+    """
+    if ids is not None:
+        qs = Appointment.objects.filter(pk__in=ids)
+    else:
+        qs = Appointment.objects.filter(
+            Q(bus_time_manual=departure_time) | Q(bus_time_manual__isnull=True, bus_time_computed=departure_time),
+            appointment_date=day, has_taxi=False,
+        )
+    with transaction.atomic():
+        changed = qs.exclude(status=status).update(status=status, updated_at=timezone.now())
+        if changed:
+            _rows_changed(*([day] if ids is None else qs.dates('appointment_date', 'day')))
+    return changed
@@ -0,0 +1,158 @@
+# dgp_bus/db_router.py
+"""
+Read replica routing.
+
+Reads go to the 'replica' database only inside `replica_reads()`: the public boards,
+the patient and appointment lists (`@on_replica`), the CSV exports and the taxi report. Everything
+else, and every write, uses 'default'.
+
+A client that just wrote (any successful non-GET request) is pinned to the primary for
+DB_REPLICA_PIN_SECONDS, so it reads its own writes. The replica is skipped while it lags
+more than DB_REPLICA_MAX_LAG seconds or is down; its health is checked at most once per
+DB_REPLICA_CHECK_INTERVAL and shared through the cache. Without a 'replica' database
+configured all of this is a no-op.
+"""
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.throttling import BaseThrottle
+
+REPLICA = 'replica'
+HEALTH_KEY = 'db-replica-ok'
+PIN_PREFIX = 'db-pin:'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_primary_only = ContextVar('primary_only', default=False)
+
+
+def replica_lag():
+    """Seconds the replica is behind, 0 if it isn't replicating (e.g. a local SQLite copy)."""
+    with connections[REPLICA].cursor() as cursor:
+        if connections[REPLICA].vendor != 'mysql':
+            cursor.execute('SELECT 1')
+            return 0
+        try:
+            cursor.execute('SHOW REPLICA STATUS')  # MySQL 8.0.22+
+            lag_column = 'Seconds_Behind_Source'
+        except DatabaseError:
+            cursor.execute('SHOW SLAVE STATUS')
+            lag_column = 'Seconds_Behind_Master'
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        # NULL while replication is stopped or broken
+        return dict(zip([c[0] for c in cursor.description], row))[lag_column]
+
+
+def check_replica():
+    try:
+        lag = replica_lag()
+    except DatabaseError as e:
+        print(f"[ERROR] Read replica unavailable, reading from primary: {e}")
+        return False
+    if lag is None or lag > settings.DB_REPLICA_MAX_LAG:
+        print(f"[WARNING] Read replica lags ({lag} s), reading from primary")
+        return False
+    return True
+
+
+def mark_replica_down():
+    cache.set(HEALTH_KEY, False, timeout=settings.DB_REPLICA_CHECK_INTERVAL)
+
+
+def client_ident(request):
+    # the bearer token identifies an API client without a database lookup; anonymous clients go by IP
+    auth = request.META.get('HTTP_AUTHORIZATION')
+    if auth:
+        return hashlib.sha256(auth.encode()).hexdigest()
+    return BaseThrottle().get_ident(request)
+
+
+def replica_usable(request=None):
+    if REPLICA not in connections.databases or _primary_only.get():
+        return False
+    pin_key = PIN_PREFIX + client_ident(request) if request is not None else None
+    found = cache.get_many([HEALTH_KEY, pin_key] if pin_key else [HEALTH_KEY])
+    if pin_key in found:
+        return False
+    healthy = found.get(HEALTH_KEY)
+    if healthy is None:
+        healthy = check_replica()
+        cache.set(HEALTH_KEY, healthy, timeout=settings.DB_REPLICA_CHECK_INTERVAL)
+    return healthy
+
+
+@contextmanager
+def _reads_from(replica):
+    token = _replica_reads.set(replica)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Keep reads in this block on the primary, also inside replica_reads() and @on_replica."""
+    token = _primary_only.set(True)
+    try:
+        with _reads_from(False):
+            yield
+    finally:
+        _primary_only.reset(token)
+
+
+def replica_reads(request=None):
+    """Send reads in this block to the replica, unless it is unusable or `request`'s client is pinned."""
+    return _reads_from(replica_usable(request))
+
+
+def on_replica(view_method):
+    """Run a read-only view method against the replica, retrying on the primary if the replica fails."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not replica_usable(request):
+            return view_method(self, request, *args, **kwargs)
+        try:
+            with _reads_from(True):
+                return view_method(self, request, *args, **kwargs)
+        except DatabaseError as e:
+            print(f"[ERROR] Read replica query failed, retrying on primary: {e}")
+            mark_replica_down()
+            return view_method(self, request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # also for instances that were read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # same data on both
+        return True
+
+
+class ReplicaPinMiddleware:
+    """Pin a client to the primary for a while after it writes (read-your-writes)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and REPLICA in connections.databases):
+            cache.set(PIN_PREFIX + client_ident(request), True, timeout=settings.DB_REPLICA_PIN_SECONDS)
+        return response
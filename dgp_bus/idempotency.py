@@ -0,0 +1,107 @@
+# dgp_bus/idempotency.py
+"""
+Idempotency-Key support for the public create endpoints.
+
+The first response (2xx) to a key is stored in the default cache, i.e. the Redis
+server Celery uses, or local memory with CACHE_URL=locmem://. A retry with the same
+key and body gets that response back with `Idempotent-Replayed: true` and never
+reaches the view. While the first request is still running, `cache.add` on a lock key
+turns concurrent retries away with 409. Reusing a key for a different body is a 422.
+Requests without the header behave as before.
+
+Keys are scoped by endpoint and caller (the signed-in account, otherwise the client's
+IP), so one client can't replay or block another's key.
+"""
+import hashlib
+import secrets
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .db_router import client_ident
+from .redis_scripts import run_script
+
+HEADER = 'Idempotency-Key'
+KEY_PREFIX = 'idem:'
+
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _caller(request):
+    user = request.user
+    if user and user.is_authenticated:
+        # staff and site user ids overlap
+        return f"user:{getattr(user, 'user_type', type(user).__name__)}:{user.pk}"
+    return f'ip:{client_ident(request)}'
+
+
+def _release_local(keys, args):
+    if cache.get(keys[0]) == args[0]:
+        cache.delete(keys[0])
+
+
+def _release(lock_key, token):
+    """Delete the lock only if it is still ours; after a timeout it may belong to another request."""
+    # ints are stored as plain Redis integers, so the token compares as a string
+    run_script(RELEASE_LOCK, [lock_key], [token], _release_local)
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response({'error': f'{HEADER} was already used for a different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'], headers=stored['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """Make a view method honour the Idempotency-Key header."""
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # keys are per endpoint and caller; the fingerprint catches a key reused for another payload
+        cache_key = KEY_PREFIX + hashlib.sha256(f'{request.path}\n{_caller(request)}\n{key}'.encode()).hexdigest()
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        lock_key = cache_key + ':lock'
+        token = secrets.randbits(62)
+        if not cache.add(lock_key, token, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            return Response({'error': f'A request with this {HEADER} is still being processed.'},
+                            status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+        try:
+            # the first request may have finished between the lookup and taking the lock
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+
+            response = view_method(self, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                    'headers': {h: response[h] for h in ('Location',) if response.has_header(h)},
+                }, timeout=settings.IDEMPOTENCY_KEY_TTL)
+            return response
+        finally:
+            _release(lock_key, token)
+
+    return wrapper
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from dgp_bus.archive import archive_appointments
+
+
+class Command(BaseCommand):
+    help = 'Move past appointments to the compressed archive (restartable, in bounded batches)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, help='Age in days (default: APPOINTMENT_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, help='Rows per batch (default: APPOINTMENT_ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+
+    def handle(self, *args, **options):
+        moved = archive_appointments(
+            older_than_days=options['older_than'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} appointment(s)'))
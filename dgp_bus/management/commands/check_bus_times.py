@@ -0,0 +1,44 @@
+import csv
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from dgp_bus.models import Appointment
+from dgp_bus.rides import schedule_ride_refresh
+from dgp_bus.revisions import bump_revisions, day_scope
+
+
+class Command(BaseCommand):
+    help = 'List appointments whose stored bus_time_computed no longer matches the timetable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Include past appointments (default: today and later)')
+        parser.add_argument('--fix', action='store_true', help='Write the expected bus time back to bus_time_computed')
+
+    def handle(self, *args, **options):
+        qs = Appointment.objects.with_stale_bus_time()
+        if not options['all']:
+            qs = qs.filter(appointment_date__gte=date.today())
+
+        # The comparison runs in the database; only the stale rows come back.
+        rows = list(qs.order_by('appointment_date', 'appointment_time').values_list(
+            'id', 'appointment_date', 'appointment_time', 'hospital_id', 'bus_time_computed', 'expected_bus_time',
+        ))
+
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['Appointment ID', 'Date', 'Time', 'Hospital ID', 'Stored', 'Expected'])
+        for row in rows:
+            writer.writerow(row)
+
+        if options['fix']:
+            by_expected = {}
+            for appointment_id, *_, expected in rows:
+                by_expected.setdefault(expected, []).append(appointment_id)
+            for expected, ids in by_expected.items():
+                Appointment.objects.filter(pk__in=ids).update(bus_time_computed=expected, updated_at=timezone.now())
+            schedule_ride_refresh(*{row[1] for row in rows})
+            bump_revisions('appointments', *{day_scope('appointments', row[1]) for row in rows})
+            self.stderr.write(self.style.SUCCESS(f'Updated {len(rows)} appointment(s)'))
+        else:
+            self.stderr.write(self.style.WARNING(f'{len(rows)} stale appointment(s)') if rows
+                              else self.style.SUCCESS('All computed bus times are up to date'))
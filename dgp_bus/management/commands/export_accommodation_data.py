@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from dgp_bus.db_router import replica_reads
 from dgp_bus.models import Accommodation  # Update this import with your app name
 
 class Command(BaseCommand):
@@ -8,7 +9,7 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         file_path = 'accommodations_export.csv'
 
-        with open(file_path, mode='w', newline='') as file:
+        with replica_reads(), open(file_path, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(['Name'])
 
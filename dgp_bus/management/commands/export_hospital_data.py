@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from dgp_bus.db_router import replica_reads
 from dgp_bus.models import Hospital 
 
 class Command(BaseCommand):
@@ -10,7 +11,7 @@ class Command(BaseCommand):
         file_path = 'hospitals_export.csv'
 
         # Open a CSV file for writing
-        with open(file_path, mode='w', newline='') as file:
+        with replica_reads(), open(file_path, mode='w', newline='') as file:
             writer = csv.writer(file)
 
             # Write the header
@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from dgp_bus.reference import bump_reference
 from dgp_bus.models import Accommodation  # Update this import with your app name
 
 class Command(BaseCommand):
@@ -20,4 +21,6 @@ class Command(BaseCommand):
                     name=name
                 )
 
+        bump_reference(Accommodation)
+
         self.stdout.write(self.style.SUCCESS('Accommodation data imported successfully'))
@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from dgp_bus.reference import bump_reference
 from dgp_bus.models import Hospital  # Update 'myapp' with your app name
 
 class Command(BaseCommand):
@@ -23,4 +24,6 @@ class Command(BaseCommand):
                     defaults={'address': address, 'image_path': image_path},
                 )
 
+        bump_reference(Hospital)
+
         self.stdout.write(self.style.SUCCESS('Data imported successfully'))
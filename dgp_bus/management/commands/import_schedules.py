@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from dgp_bus.reference import bump_reference
 from dgp_bus.models import Schedule, Hospital  # Update this import with your app name
 
 class Command(BaseCommand):
@@ -32,4 +33,6 @@ class Command(BaseCommand):
                     }
                 )
 
+        bump_reference(Schedule)
+
         self.stdout.write(self.style.SUCCESS('Schedule data imported successfully'))
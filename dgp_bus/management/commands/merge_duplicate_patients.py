@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from dgp_bus.models import Appointment, Patient
+from dgp_bus.revisions import bump_revisions
+from dgp_bus.utils import patient_identity_key
+
+# filled from the most recent duplicate that has them (the latest stay)
+LATEST_FIELDS = ('phone_no', 'room', 'default_accommodation_id')
+
+
+class Command(BaseCommand):
+    help = 'Merge patients with the same identity (folded name, last name and birth date) into the oldest record'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the duplicate groups')
+
+    def handle(self, *args, **options):
+        groups = (
+            Patient.objects
+            .filter(day_of_birth__isnull=False)
+            .values('search_name', 'search_last_name', 'day_of_birth')
+            .annotate(n=Count('id'))
+            .filter(n__gt=1)
+            .order_by()
+        )
+        merged = moved = 0
+        for group in groups.iterator():
+            if options['dry_run']:
+                self.stdout.write(f"{group['search_name']} {group['search_last_name']} {group['day_of_birth']}: {group['n']}")
+                continue
+            with transaction.atomic():
+                patients = list(
+                    Patient.objects.select_for_update()
+                    .filter(search_name=group['search_name'], search_last_name=group['search_last_name'],
+                            day_of_birth=group['day_of_birth'])
+                    .order_by('id')
+                )
+                keeper, duplicates = patients[0], patients[1:]
+                for field in LATEST_FIELDS:
+                    value = next((getattr(p, field) for p in reversed(patients) if getattr(p, field)), None)
+                    if value:
+                        setattr(keeper, field, value)
+
+                moved += Appointment.objects.filter(patient__in=duplicates).update(patient=keeper, updated_at=timezone.now())
+                Patient.objects.filter(pk__in=[p.pk for p in duplicates]).delete()
+                # the identity key is free now the duplicates are gone; save() refreshes the ride manifest too
+                keeper.identity_key = patient_identity_key(keeper.name, keeper.last_name, keeper.day_of_birth)
+                keeper.save()
+                merged += len(duplicates)
+
+        if options['dry_run']:
+            return
+        if moved:
+            bump_revisions('appointments')
+        self.stdout.write(self.style.SUCCESS(f'Merged {merged} duplicate patient(s), moved {moved} appointment(s)'))
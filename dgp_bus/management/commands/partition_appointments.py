@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from dgp_bus.partitions import ensure_future_partitions, list_partitions, partition_table, supported
+
+
+class Command(BaseCommand):
+    help = 'Range-partition the appointment table by month (MySQL only) and list its partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', action='store_true', help='Only list the current partitions')
+
+    def handle(self, *args, **options):
+        if not supported():
+            raise CommandError('Table partitioning needs MySQL; nothing to do on this database')
+
+        if not options['status']:
+            if partition_table():
+                self.stdout.write(self.style.SUCCESS('Appointment table partitioned by month'))
+            else:
+                added = ensure_future_partitions()
+                self.stdout.write(f'Already partitioned; added {len(added)} month(s)')
+
+        for name, bound in list_partitions():
+            self.stdout.write(f'{name}\t< {bound or "MAXVALUE"}')
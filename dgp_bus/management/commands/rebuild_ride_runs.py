@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from dgp_bus.rides import horizon, rebuild_ride_runs
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the RideRun manifest for today and the next RIDE_RUN_DAYS days (run after deploying)'
+
+    def handle(self, *args, **options):
+        start, end = horizon()
+        rebuild_ride_runs()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the ride manifest for {start} to {end}'))
@@ -0,0 +1,28 @@
+import csv
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from dgp_bus.archive import ARCHIVE_FIELDS, read_archive, restore_appointments
+
+
+class Command(BaseCommand):
+    help = 'List or restore archived appointments for a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=date.fromisoformat)
+        parser.add_argument('end', type=date.fromisoformat)
+        parser.add_argument('--restore', action='store_true',
+                            help='Put the appointments back into the database instead of listing them as CSV')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            restored, skipped = restore_appointments(options['start'], options['end'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Restored {restored} appointment(s); skipped {skipped} (still present or patient deleted)'
+            ))
+            return
+
+        writer = csv.writer(sys.stdout)
+        writer.writerow(ARCHIVE_FIELDS)
+        for record in read_archive(options['start'], options['end']):
+            writer.writerow([record[f] for f in ARCHIVE_FIELDS])
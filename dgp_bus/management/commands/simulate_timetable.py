@@ -0,0 +1,176 @@
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from dgp_bus.models import Appointment, Schedule
+from dgp_bus.timetable import BUS_ACCOMMODATION_NAME, BUS_SCHEDULE_DESTINATIONS, BUS_TRAVEL_TIME, DANISH_WEEKDAYS
+
+WEEKDAY_NUMBERS = {name.lower(): n for n, name in DANISH_WEEKDAYS.items()}
+TRAVEL_SECONDS = int(BUS_TRAVEL_TIME.total_seconds())
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _simulate_chunk(chunk, timetable, capacity):
+    """
+    Assign one chunk of appointments to departures. Pure NumPy, so it runs in worker processes.
+    Returns (lost, waits in seconds, {(destination, weekday, departure): [runs, passengers, max_load, overflow]}).
+    """
+    days, weekdays, destinations, appt_seconds, seats, wheelchairs = chunk
+    # days without any departure to the destination count as lost too
+    lost = len(days)
+    waits = []
+    loads = {}
+
+    for (destination, weekday), departures in timetable.items():
+        mask = (destinations == destination) & (weekdays == weekday)
+        if not mask.any():
+            continue
+        latest = appt_seconds[mask] - TRAVEL_SECONDS
+        idx = np.searchsorted(departures, latest, side='right') - 1
+        on_bus = idx >= 0
+        lost -= int(on_bus.sum())
+        if not on_bus.any():
+            continue
+
+        chosen = departures[idx[on_bus]]
+        waits.append(latest[on_bus] - chosen)
+
+        # one run per (day, departure): sum the demand of everyone on it
+        runs, run_index = np.unique(
+            np.stack([days[mask][on_bus], chosen]), axis=1, return_inverse=True,
+        )
+        run_index = run_index.ravel()
+        run_seats = np.bincount(run_index, weights=seats[mask][on_bus])
+        run_wheelchairs = np.bincount(run_index, weights=wheelchairs[mask][on_bus])
+        run_passengers = np.bincount(run_index)
+        overflow = np.maximum(
+            np.maximum(run_seats - capacity[0], 0),
+            np.maximum(run_wheelchairs - capacity[1], 0),
+        )
+
+        for departure in np.unique(runs[1]):
+            sel = runs[1] == departure
+            key = (destination, weekday, int(departure))
+            agg = loads.setdefault(key, [0, 0, 0, 0])
+            agg[0] += int(sel.sum())
+            agg[1] += int(run_passengers[sel].sum())
+            agg[2] = max(agg[2], int(run_passengers[sel].max()))
+            agg[3] += int(np.ceil(overflow[sel]).sum())
+
+    return lost, np.concatenate(waits) if waits else np.empty(0, dtype=np.int64), loads
+
+
+class Command(BaseCommand):
+    help = 'Replay historical appointments against a proposed timetable and write per-departure load to CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('schedule_csv', nargs='?',
+                            help='Proposed timetable in the export_schedule_data format (default: current timetable)')
+        parser.add_argument('--start', type=date.fromisoformat, help='First appointment date (default: a year ago)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last appointment date (default: yesterday)')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes (1 runs inline)')
+        parser.add_argument('--output', default='timetable_simulation.csv')
+
+    def load_timetable(self, path):
+        if path is None:
+            rows = Schedule.objects.values_list('destination_id', 'day_of_week', 'departure_time')
+            rows = [(d, day, _seconds(t)) for d, day, t in rows]
+        else:
+            with open(path, mode='r') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip the header row
+                rows = []
+                for destination_id, day_of_week, departure_time, _location in reader:
+                    h, m, *s = (int(part) for part in departure_time.split(':'))
+                    rows.append((int(destination_id), day_of_week, h * 3600 + m * 60 + (s[0] if s else 0)))
+
+        timetable = {}
+        for destination_id, day_of_week, seconds in rows:
+            weekday = WEEKDAY_NUMBERS.get(day_of_week.lower())
+            if weekday is None:
+                raise CommandError(f'Unknown day of week: {day_of_week}')
+            timetable.setdefault((destination_id, weekday), []).append(seconds)
+        return {key: np.array(sorted(times), dtype=np.int64) for key, times in timetable.items()}
+
+    def load_appointments(self, start, end):
+        rows = (
+            Appointment.objects
+            .filter(
+                appointment_date__range=[start, end],
+                accommodation__name=BUS_ACCOMMODATION_NAME,
+                hospital_id__in=list(BUS_SCHEDULE_DESTINATIONS),
+            )
+            .order_by('appointment_date')
+            .values_list('appointment_date', 'appointment_time', 'hospital_id', 'wheelchair', 'companion')
+        )
+        days, weekdays, destinations, appt_seconds, seats, wheelchairs = [], [], [], [], [], []
+        for d, t, hospital_id, wheelchair, companion in rows.iterator(chunk_size=5000):
+            days.append(d.toordinal())
+            weekdays.append(d.isoweekday())
+            destinations.append(BUS_SCHEDULE_DESTINATIONS[hospital_id])
+            appt_seconds.append(_seconds(t))
+            # a wheelchair space replaces the seat, as in dgp_bus.planner
+            seats.append((0 if wheelchair else 1) + (1 if companion else 0))
+            wheelchairs.append(1 if wheelchair else 0)
+        return tuple(np.array(a, dtype=np.int64) for a in (days, weekdays, destinations, appt_seconds, seats, wheelchairs))
+
+    def handle(self, *args, **options):
+        end = options['end'] or date.today() - timedelta(days=1)
+        start = options['start'] or end - timedelta(days=365)
+        timetable = self.load_timetable(options['schedule_csv'])
+        arrays = self.load_appointments(start, end)
+        total = len(arrays[0])
+        capacity = (
+            sum(v['seats'] for v in settings.BUS_VEHICLES),
+            sum(v['wheelchairs'] for v in settings.BUS_VEHICLES),
+        )
+
+        # split on day boundaries so no run straddles two chunks
+        workers = max(options['workers'], 1)
+        bounds = np.searchsorted(arrays[0], np.linspace(arrays[0].min(), arrays[0].max() + 1, workers + 1)) if total else [0, 0]
+        chunks = [tuple(a[lo:hi] for a in arrays) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+        if workers == 1 or len(chunks) <= 1:
+            results = [_simulate_chunk(chunk, timetable, capacity) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_simulate_chunk, chunks, [timetable] * len(chunks), [capacity] * len(chunks)))
+
+        lost = sum(r[0] for r in results)
+        waits = np.concatenate([r[1] for r in results]) if results else np.empty(0)
+        loads = {}
+        for _, _, chunk_loads in results:
+            for key, (runs, passengers, max_load, overflow) in chunk_loads.items():
+                agg = loads.setdefault(key, [0, 0, 0, 0])
+                agg[0] += runs
+                agg[1] += passengers
+                agg[2] = max(agg[2], max_load)
+                agg[3] += overflow
+
+        with open(options['output'], mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Destination ID', 'Day of Week', 'Departure Time', 'Runs', 'Passengers',
+                             'Average Load', 'Max Load', 'Overflow'])
+            for (destination, weekday, departure), (runs, passengers, max_load, overflow) in sorted(loads.items()):
+                writer.writerow([
+                    destination, DANISH_WEEKDAYS[weekday],
+                    f'{departure // 3600:02d}:{departure % 3600 // 60:02d}:{departure % 60:02d}',
+                    runs, passengers, f'{passengers / runs:.1f}', max_load, overflow,
+                ])
+
+        overflow = sum(agg[3] for agg in loads.values())
+        self.stdout.write(f'Appointments: {total} ({start} - {end})')
+        self.stdout.write(f'Lost bus: {lost}')
+        if waits.size:
+            self.stdout.write(
+                f'Wait at hospital (min): mean {waits.mean() / 60:.1f}, median {np.median(waits) / 60:.1f}, '
+                f'p90 {np.percentile(waits, 90) / 60:.1f}'
+            )
+        self.stdout.write(f'Taxis needed: {lost + overflow} ({lost} without a bus, {overflow} over capacity)')
+        self.stdout.write(self.style.SUCCESS(f'Per-departure load written to {options["output"]}'))
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-19 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0008_auto_20250924_1204'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('departure_time', models.TimeField()),
+                ('departure_location', models.CharField(blank=True, max_length=255)),
+                ('passengers', models.JSONField(default=list)),
+                ('passenger_count', models.PositiveIntegerField(default=0)),
+                ('wheelchair_count', models.PositiveIntegerField(default=0)),
+                ('trolley_count', models.PositiveIntegerField(default=0)),
+                ('companion_count', models.PositiveIntegerField(default=0)),
+                ('translator_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ride_runs', to='dgp_bus.hospital')),
+            ],
+            options={
+                'ordering': ['date', 'departure_time', 'departure_location'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'departure_time', 'departure_location', 'destination'), name='unique_ride_run')],
+            },
+        ),
+    ]
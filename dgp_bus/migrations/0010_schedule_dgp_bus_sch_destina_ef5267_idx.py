@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-19 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0009_riderun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['destination', 'day_of_week', 'departure_time'], name='dgp_bus_sch_destina_ef5267_idx'),
+        ),
+    ]
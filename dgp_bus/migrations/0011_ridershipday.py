@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-19 02:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0010_schedule_dgp_bus_sch_destina_ef5267_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RidershipDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('weekday', models.PositiveSmallIntegerField()),
+                ('departure_time', models.TimeField(blank=True, null=True)),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('checked_in', models.PositiveIntegerField(default=0)),
+                ('wheelchair', models.PositiveIntegerField(default=0)),
+                ('trolley', models.PositiveIntegerField(default=0)),
+                ('companion', models.PositiveIntegerField(default=0)),
+                ('translator', models.PositiveIntegerField(default=0)),
+                ('taxi', models.PositiveIntegerField(default=0)),
+                ('accommodation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dgp_bus.accommodation')),
+                ('hospital', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dgp_bus.hospital')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='dgp_bus_rid_date_39e146_idx'), models.Index(fields=['hospital', 'weekday', 'date'], name='dgp_bus_rid_hospita_844133_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0011_ridershipday'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['translator', 'appointment_date', 'appointment_time'], name='appt_translator_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['bus_time_manual', 'bus_time_computed', 'appointment_date'], name='appt_missing_bus_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['name', 'room'], name='patient_name_room_idx'),
+        ),
+    ]
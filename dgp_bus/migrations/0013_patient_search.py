@@ -0,0 +1,80 @@
+# Generated by Django 5.1 on 2026-10-19 02:25
+
+import unicodedata
+
+from django.db import migrations, models
+
+# frozen copy of dgp_bus.utils.fold_search_text, so later changes there don't alter this migration
+SEARCH_FOLD = str.maketrans({'æ': 'ae', 'ø': 'o', 'đ': 'd', 'ł': 'l', 'ĸ': 'q'})
+
+
+def fold_search_text(value):
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.translate(SEARCH_FOLD).split())
+
+
+def backfill_search_columns(apps, schema_editor):
+    Patient = apps.get_model('dgp_bus', 'Patient')
+    batch = []
+    for p in Patient.objects.only('name', 'last_name').iterator(chunk_size=2000):
+        p.search_name = fold_search_text(p.name)
+        p.search_last_name = fold_search_text(p.last_name)
+        batch.append(p)
+        if len(batch) == 2000:
+            Patient.objects.bulk_update(batch, ['search_name', 'search_last_name'])
+            batch = []
+    Patient.objects.bulk_update(batch, ['search_name', 'search_last_name'])
+
+
+def add_fulltext_index(apps, schema_editor):
+    # optional backing for PATIENT_SEARCH_FULLTEXT; MySQL only
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX patient_search_ft ON dgp_bus_patient (search_name, search_last_name)'
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX patient_search_ft ON dgp_bus_patient')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0012_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='patient_name_room_idx',
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='search_last_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_search_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['search_name', 'room'], name='patient_name_room_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['search_name', 'search_last_name'], name='patient_search_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['search_last_name'], name='patient_search_last_name_idx'),
+        ),
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+    ]
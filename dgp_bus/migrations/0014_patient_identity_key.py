@@ -0,0 +1,57 @@
+# Generated by Django 5.1 on 2026-10-19 02:29
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+# frozen copies of dgp_bus.utils.fold_search_text and patient_identity_key, so later changes
+# there don't alter this migration
+SEARCH_FOLD = str.maketrans({'æ': 'ae', 'ø': 'o', 'đ': 'd', 'ł': 'l', 'ĸ': 'q'})
+
+
+def fold_search_text(value):
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.translate(SEARCH_FOLD).split())
+
+
+def patient_identity_key(name, last_name, day_of_birth):
+    identity = f'{fold_search_text(name)}|{fold_search_text(last_name)}|{day_of_birth.isoformat()}'
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def backfill_identity_keys(apps, schema_editor):
+    # only the oldest patient of each identity gets the key; merge_duplicate_patients folds in the rest
+    Patient = apps.get_model('dgp_bus', 'Patient')
+    seen, batch = set(), []
+    rows = Patient.objects.filter(day_of_birth__isnull=False).only('name', 'last_name', 'day_of_birth').order_by('id')
+    for p in rows.iterator(chunk_size=2000):
+        key = patient_identity_key(p.name, p.last_name, p.day_of_birth)
+        if key in seen:
+            continue
+        seen.add(key)
+        p.identity_key = key
+        batch.append(p)
+        if len(batch) == 2000:
+            Patient.objects.bulk_update(batch, ['identity_key'])
+            batch = []
+    Patient.objects.bulk_update(batch, ['identity_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0013_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='identity_key',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_identity_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1 on 2026-10-19 03:00
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dgp_bus', '0015_appointment_changes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='schedule',
+            name='dgp_bus_sch_destina_ef5267_idx',
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(models.F('destination'), django.db.models.functions.text.Lower('day_of_week'), models.F('departure_time'), name='schedule_dest_day_time_idx'),
+        ),
+    ]
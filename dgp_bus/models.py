@@ -1,6 +1,12 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, When, Value, OuterRef, Subquery, Count, F, lookups
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, ExtractHour, ExtractMinute, ExtractSecond, Lower
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from .utils import fold_search_text, patient_identity_key
+from .timetable import BUS_ACCOMMODATION_NAME, BUS_SCHEDULE_DESTINATIONS, BUS_TRAVEL_TIME, DANISH_WEEKDAYS
 
 
 
@@ -104,6 +110,12 @@ class Schedule(models.Model):
     departure_time = models.TimeField()
     departure_location = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            # the departure lookups compare lower(day_of_week); a plain column index can't serve them
+            models.Index(F('destination'), Lower('day_of_week'), F('departure_time'), name='schedule_dest_day_time_idx'),
+        ]
+
     def __str__(self):
         return f'{self.departure_location} to {self.destination.hospital_name} on {self.day_of_week}'
 
@@ -117,6 +129,95 @@ class Accommodation(models.Model):
     def __str__(self):
         return self.name
 
+# MySQL's default innodb_ft_min_token_size
+FULLTEXT_MIN_TOKEN_SIZE = 3
+
+
+def _prefix(field, term, vendor):
+    if vendor != 'sqlite':
+        # LIKE 'term%', an index range on MySQL
+        return models.Q(**{f'{field}__istartswith': term})
+    # SQLite only uses the index for the range spelled out; the 4-byte bound would fail outside utf8mb4 on MySQL
+    return models.Q(**{f'{field}__gte': term, f'{field}__lt': term + '\U0010ffff'})
+
+
+class FoldedPrefix(lookups.IStartsWith):
+    """Prefix match on a fold_search_text column, with the term folded the same way (admin search)."""
+    lookup_name = 'folded_prefix'
+
+    def get_prep_lookup(self):
+        return fold_search_text(super().get_prep_lookup())
+
+    def as_sql(self, compiler, connection):
+        return lookups.IStartsWith(self.lhs, self.rhs).as_sql(compiler, connection)
+
+
+IDENTITY_FIELDS = ('name', 'last_name', 'day_of_birth')
+
+
+class PatientQuerySet(models.QuerySet):
+    def update_or_create_identity(self, **fields):
+        """
+        Create a patient, or update the one with the same identity (see patient_identity_key):
+        only the other fields that were filled in and differ are saved, so a blank phone
+        number doesn't clear the stored one. Returns (patient, created).
+        """
+        key = patient_identity_key(fields.get('name'), fields.get('last_name'), fields.get('day_of_birth'))
+        if key is None:
+            return self.create(**fields), True
+
+        patient = self.filter(identity_key=key).first()
+        if patient is None:
+            try:
+                with transaction.atomic():
+                    return self.create(**fields), True
+            except IntegrityError:
+                # a concurrent submission inserted the same identity first
+                patient = self.get(identity_key=key)
+
+        # the identity matched up to case and accents; the stored spelling stays
+        changed = []
+        for name, value in fields.items():
+            if name in IDENTITY_FIELDS or value in (None, ''):
+                continue
+            attname = self.model._meta.get_field(name).attname
+            before = getattr(patient, attname)
+            setattr(patient, name, value)
+            if getattr(patient, attname) != before:
+                changed.append(name)
+        if changed:
+            patient.save(update_fields=changed)
+        return patient, False
+
+    def search(self, query):
+        """
+        Patients whose first or last name starts with every word of `query`,
+        compared case- and diacritic-folded.
+        """
+        terms = fold_search_text(query).split()
+        if not terms:
+            return self.none()
+        qs, vendor = self, connections[self.db].vendor
+        for term in terms:
+            qs = qs.filter(_prefix('search_name', term, vendor) | _prefix('search_last_name', term, vendor))
+        return qs
+
+    def fulltext_search(self, query):
+        """
+        search() through the MySQL FULLTEXT index on the folded names. Words shorter than
+        innodb_ft_min_token_size aren't in that index, so those queries fall back to search().
+        """
+        terms = fold_search_text(query).split()
+        if not terms or min(len(t) for t in terms) < FULLTEXT_MIN_TOKEN_SIZE:
+            return self.search(query)
+        # boolean mode: every word required, as a prefix; strip the mode's operators from user input
+        against = ' '.join('+{}*'.format(''.join(c for c in t if c.isalnum())) for t in terms)
+        return self.filter(RawSQL(
+            'MATCH (search_name, search_last_name) AGAINST (%s IN BOOLEAN MODE)', [against],
+            output_field=models.BooleanField(),
+        ))
+
+
 class Patient(models.Model):
     # personal-only
     name = models.CharField(max_length=255)
@@ -130,13 +231,176 @@ class Patient(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # folded copies of the names (see fold_search_text), kept in sync by save()
+    search_name = models.CharField(max_length=255, blank=True, default='', editable=False)
+    search_last_name = models.CharField(max_length=255, blank=True, default='', editable=False)
+    # unique per person; NULL without a birth date, or for duplicates merge_duplicate_patients hasn't merged yet
+    identity_key = models.CharField(max_length=40, unique=True, null=True, blank=True, editable=False)
+
+    objects = PatientQuerySet.as_manager()
+
     class Meta:
-        indexes = [models.Index(fields=['name', 'last_name'])]
+        indexes = [
+            models.Index(fields=['name', 'last_name']),
+            models.Index(fields=['search_name', 'room'], name='patient_name_room_idx'),
+            models.Index(fields=['search_name', 'search_last_name'], name='patient_search_name_idx'),
+            models.Index(fields=['search_last_name'], name='patient_search_last_name_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_identity = instance._identity()
+        return instance
+
+    def _identity(self):
+        # deferred fields count as unchanged
+        deferred = self.get_deferred_fields()
+        return tuple(None if f in deferred else getattr(self, f) for f in IDENTITY_FIELDS)
+
+    def identity_conflict(self):
+        """Another patient with the identity this one would get on save, or None."""
+        key = patient_identity_key(self.name, self.last_name, self.day_of_birth)
+        if key is None:
+            return None
+        return Patient.objects.filter(identity_key=key).exclude(pk=self.pk).first()
+
+    def clean(self):
+        other = self.identity_conflict() if self._identity() != getattr(self, '_loaded_identity', None) else None
+        if other is not None:
+            raise ValidationError(f'Patient #{other.pk} already has this name, last name and birth date.')
+
+    def save(self, *args, **kwargs):
+        self.search_name = fold_search_text(self.name)
+        self.search_last_name = fold_search_text(self.last_name)
+        # only on create or an identity change: unmerged duplicates (identity_key NULL) stay saveable
+        if self._identity() != getattr(self, '_loaded_identity', None):
+            self.identity_key = patient_identity_key(self.name, self.last_name, self.day_of_birth)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_name', 'search_last_name', 'identity_key'}
+        super().save(*args, **kwargs)
+        self._loaded_identity = self._identity()
 
     def __str__(self):
         return f'{self.name} {self.last_name}'.strip()
 
 
+for _field in ('search_name', 'search_last_name'):
+    Patient._meta.get_field(_field).register_lookup(FoldedPrefix)
+
+
+def _seconds_of_day(expr):
+    # portable TIME -> seconds; avoids backend-specific time/interval arithmetic
+    return ExtractHour(expr) * 3600 + ExtractMinute(expr) * 60 + ExtractSecond(expr)
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def with_bus_route(self):
+        """
+        Annotate `bus_destination_id` (timetable destination, None when the trip isn't
+        served by bus) and `bus_weekday` (lower-case Danish day name, as in Schedule).
+        """
+        return self.annotate(
+            bus_destination_id=Case(
+                *[When(hospital_id=hospital_id, accommodation__name=BUS_ACCOMMODATION_NAME, then=Value(destination_id))
+                  for hospital_id, destination_id in BUS_SCHEDULE_DESTINATIONS.items()],
+                default=None,
+                output_field=models.BigIntegerField(),
+            ),
+            bus_weekday=Case(
+                *[When(appointment_date__iso_week_day=n, then=Value(name.lower()))
+                  for n, name in DANISH_WEEKDAYS.items()],
+                output_field=models.CharField(),
+            ),
+        )
+
+    def with_expected_bus_time(self):
+        """
+        Annotate `expected_bus_time`: the bus time the routing rule yields against the
+        current timetable, computed in the database for the whole queryset.
+        """
+        departures = (
+            Schedule.objects
+            .annotate(day=Lower('day_of_week'), departure_seconds=_seconds_of_day('departure_time'))
+            .filter(
+                destination_id=OuterRef('bus_destination_id'),
+                day=OuterRef('bus_weekday'),
+                departure_seconds__lte=OuterRef('bus_latest_departure_seconds'),
+            )
+            .order_by('-departure_time')
+            .values('departure_time')[:1]
+        )
+        return self.with_bus_route().annotate(
+            bus_latest_departure_seconds=(
+                _seconds_of_day('appointment_time') - int(BUS_TRAVEL_TIME.total_seconds())
+            ),
+            expected_bus_time=Subquery(departures, output_field=models.TimeField()),
+        )
+
+    def departure_loads(self):
+        """
+        One row per (date, effective bus time, destination) with passenger, wheelchair,
+        trolley and companion counts and the timetable's departure location, in a single
+        GROUP BY. Appointments without a bus time, and taxi passengers, are left out.
+        """
+        location = (
+            Schedule.objects
+            .annotate(day=Lower('day_of_week'))
+            .filter(
+                destination_id=OuterRef('destination_id'),
+                day=OuterRef('bus_weekday'),
+                departure_time=OuterRef('bus_time'),
+            )
+            .values('departure_location')[:1]
+        )
+        return (
+            self.with_bus_route()
+            .annotate(
+                bus_time=Coalesce('bus_time_manual', 'bus_time_computed'),
+                destination_id=Coalesce('bus_destination_id', 'hospital_id', output_field=models.BigIntegerField()),
+            )
+            # taxi passengers don't ride, as in the planner
+            .filter(bus_time__isnull=False, has_taxi=False)
+            .values('appointment_date', 'bus_time', 'destination_id', 'bus_weekday')
+            .annotate(
+                passengers=Count('id'),
+                wheelchairs=Count('id', filter=models.Q(wheelchair=True)),
+                trolleys=Count('id', filter=models.Q(trolley=True)),
+                companions=Count('id', filter=models.Q(companion=True)),
+                departure_location=Subquery(location),
+            )
+            .order_by('appointment_date', 'bus_time', 'destination_id')
+        )
+
+    def for_translators(self, start, end):
+        """Appointments needing a translator from start to end, in time order."""
+        return (
+            self.filter(translator=True, appointment_date__range=[start, end])
+            .order_by('appointment_date', 'appointment_time')
+        )
+
+    def without_bus_time(self):
+        """Appointments with neither a manual nor a computed bus time, i.e. taxi candidates."""
+        return self.filter(bus_time_manual__isnull=True, bus_time_computed__isnull=True)
+
+    def for_patient(self, name, room, accommodation):
+        """Appointments of the patient `name` (folded match) in `room`; `accommodation` is an id or a name."""
+        qs = self.filter(patient__search_name=fold_search_text(name), patient__room=room)
+        if str(accommodation).isdigit():
+            return qs.filter(accommodation_id=int(accommodation))
+        return qs.filter(accommodation__name=accommodation)
+
+    def with_stale_bus_time(self):
+        """Appointments without a manual override whose stored computed bus time differs from the timetable."""
+        return self.with_expected_bus_time().filter(bus_time_manual__isnull=True).filter(
+            models.Q(expected_bus_time__isnull=True, bus_time_computed__isnull=False)
+            | models.Q(expected_bus_time__isnull=False, bus_time_computed__isnull=True)
+            | (~models.Q(bus_time_computed=models.F('expected_bus_time'))
+               & models.Q(expected_bus_time__isnull=False, bus_time_computed__isnull=False))
+        )
+
+
 class Appointment(models.Model):
     patient = models.ForeignKey('Patient', on_delete=models.CASCADE, related_name='appointments')
     hospital = models.ForeignKey('Hospital', on_delete=models.PROTECT)
@@ -162,14 +426,96 @@ class Appointment(models.Model):
     departure_location = models.CharField(max_length=255, blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # delta sync cursor (appointments/changes); bulk .update() calls must set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AppointmentQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so a date change can refresh the ride manifest of the old day too
+        instance._loaded_appointment_date = instance.__dict__.get('appointment_date')
+        return instance
 
     class Meta:
         indexes = [
             models.Index(fields=['appointment_date']),
             models.Index(fields=['appointment_date', 'appointment_time']),
+            # translator-view: equality on the flag, then the date range in time order
+            models.Index(fields=['translator', 'appointment_date', 'appointment_time'], name='appt_translator_date_idx'),
+            # taxi views: IS NULL on both bus times is an equality lookup, then the date range
+            models.Index(fields=['bus_time_manual', 'bus_time_computed', 'appointment_date'],
+                         name='appt_missing_bus_time_idx'),
+            models.Index(fields=['updated_at'], name='appt_updated_at_idx'),
         ]
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        super().save(*args, **kwargs)
+
     @property
     def bus_time_effective(self):
         return self.bus_time_manual or self.bus_time_computed
 
+
+# Deleted upcoming appointments, so delta sync clients can drop them (see appointments/changes)
+class AppointmentTombstone(models.Model):
+    appointment_id = models.BigIntegerField()
+    appointment_date = models.DateField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+
+# Ride manifest: one row per departure, maintained by dgp_bus.rides
+class RideRun(models.Model):
+    date = models.DateField()
+    departure_time = models.TimeField()
+    departure_location = models.CharField(max_length=255, blank=True)
+    destination = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='ride_runs')
+
+    passengers = models.JSONField(default=list)
+    passenger_count = models.PositiveIntegerField(default=0)
+    wheelchair_count = models.PositiveIntegerField(default=0)
+    trolley_count = models.PositiveIntegerField(default=0)
+    companion_count = models.PositiveIntegerField(default=0)
+    translator_count = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date', 'departure_time', 'departure_location']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'departure_time', 'departure_location', 'destination'],
+                name='unique_ride_run',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.departure_time:%H:%M} {self.departure_location} to {self.destination_id}'
+
+
+# Daily ridership rollup, filled by dgp_bus.ridership before raw appointments are purged
+class RidershipDay(models.Model):
+    date = models.DateField()
+    weekday = models.PositiveSmallIntegerField()  # isoweekday: 1 = Monday
+    hospital = models.ForeignKey(Hospital, on_delete=models.CASCADE, related_name='+')
+    accommodation = models.ForeignKey(Accommodation, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    departure_time = models.TimeField(null=True, blank=True)  # effective bus time; null = no bus
+
+    appointments = models.PositiveIntegerField(default=0)
+    checked_in = models.PositiveIntegerField(default=0)
+    wheelchair = models.PositiveIntegerField(default=0)
+    trolley = models.PositiveIntegerField(default=0)
+    companion = models.PositiveIntegerField(default=0)
+    translator = models.PositiveIntegerField(default=0)
+    taxi = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date']),
+            models.Index(fields=['hospital', 'weekday', 'date']),
+        ]
@@ -0,0 +1,159 @@
+# dgp_bus/partitions.py
+"""
+Monthly range partitioning of the appointment table (MySQL only).
+
+The table is partitioned by RANGE COLUMNS(appointment_date), one partition per month
+named pYYYYMM plus a catch-all pmax, so date-filtered queries prune to the months they
+touch and old months leave the table by DROP PARTITION instead of row-by-row deletes.
+
+InnoDB can't partition a table that has foreign keys, so the conversion drops the FK
+constraints of the appointment table (Django still applies on_delete itself) and widens
+the primary key to (id, appointment_date). On any other database, SQLite included,
+everything here is a no-op.
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection
+
+from .archive import export_day
+from .models import Appointment
+from .revisions import bump_revisions
+from .ridership import rollup_ridership
+
+TABLE = Appointment._meta.db_table
+
+
+def supported():
+    return connection.vendor == 'mysql'
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _partition(month):
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{_next_month(month):%Y-%m-%d}')"
+
+
+def list_partitions():
+    """[(name, exclusive upper bound or None for pmax)], empty if the table isn't partitioned."""
+    if not supported():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+    return [(name, None if bound == 'MAXVALUE' else date.fromisoformat(bound.strip("'"))) for name, bound in rows]
+
+
+def is_partitioned():
+    return bool(list_partitions())
+
+
+def _target_month():
+    return _month(date.today() + timedelta(days=31 * settings.APPOINTMENT_PARTITION_MONTHS_AHEAD))
+
+
+def partition_table():
+    """Convert the appointment table to monthly partitions. Returns False if nothing was done."""
+    if not supported() or is_partitioned():
+        return False
+
+    first = Appointment.objects.order_by('appointment_date').values_list('appointment_date', flat=True).first()
+    month = _month(first or date.today())
+    months = []
+    while month <= _target_month():
+        months.append(month)
+        month = _next_month(month)
+
+    table = connection.ops.quote_name(TABLE)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'FOREIGN KEY'",
+            [TABLE],
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {table} DROP FOREIGN KEY {connection.ops.quote_name(name)}')
+        # every unique key must contain the partitioning column
+        cursor.execute(f'ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, appointment_date)')
+        cursor.execute(
+            f'ALTER TABLE {table} PARTITION BY RANGE COLUMNS(appointment_date) ('
+            + ', '.join([_partition(m) for m in months] + ['PARTITION pmax VALUES LESS THAN (MAXVALUE)'])
+            + ')'
+        )
+    return True
+
+
+def ensure_future_partitions():
+    """Split months up to APPOINTMENT_PARTITION_MONTHS_AHEAD out of pmax. Returns the names added."""
+    bounds = [bound for _, bound in list_partitions() if bound is not None]
+    if not bounds:
+        return []
+
+    months = []
+    month = bounds[-1]
+    while month <= _target_month():
+        months.append(month)
+        month = _next_month(month)
+    if months:
+        # pmax only holds dates beyond the last month, so this is normally an empty reorganize
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE {connection.ops.quote_name(TABLE)} REORGANIZE PARTITION pmax INTO ('
+                + ', '.join([_partition(m) for m in months] + ['PARTITION pmax VALUES LESS THAN (MAXVALUE)'])
+                + ')'
+            )
+    return [f'p{m:%Y%m}' for m in months]
+
+
+def drop_old_partitions(older_than_days=None):
+    """
+    Drop the partitions whose whole month is older than `older_than_days` (default
+    APPOINTMENT_ARCHIVE_AFTER_DAYS), exporting any rows still in them to the archive first.
+    Returns the names dropped.
+    """
+    older_than_days = settings.APPOINTMENT_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = date.today() - timedelta(days=older_than_days)
+    partitions = list_partitions()
+    # keep at least one month partition in front of pmax
+    droppable = [(name, bound) for name, bound in partitions[:-2] if bound <= cutoff]
+    if not droppable:
+        return []
+
+    # the rollup must see the rows before they leave the hot table
+    rollup_ridership()
+
+    dropped = []
+    for name, bound in droppable:
+        days = (
+            Appointment.objects
+            .filter(appointment_date__lt=bound)
+            .order_by('appointment_date')
+            .values_list('appointment_date', flat=True)
+            .distinct()
+        )
+        for day in days:
+            export_day(day)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {connection.ops.quote_name(TABLE)} DROP PARTITION {name}')
+        dropped.append(name)
+
+    bump_revisions('appointments')
+    return dropped
+
+
+def maintain_partitions():
+    """Add upcoming months and retire old ones. Returns (added, dropped)."""
+    if not is_partitioned():
+        return [], []
+    return ensure_future_partitions(), drop_old_partitions()
@@ -1,12 +1,11 @@
 # dgp_bus/permissions.py
 from rest_framework.permissions import BasePermission
-from django.contrib.auth import get_user_model
-from dgp_bus.models import SiteUser
+from dgp_bus.models import SiteUser, StaffAdminUser
 
 class IsSiteUser(BasePermission):
     """
-    Site-level access: allow any authenticated account when SiteUser is the AUTH_USER_MODEL.
-    Keeps the hook for future role rules.
+    Site-level access: any active site user or staff account.
+    With claim-bearing JWTs this is decided from the token alone (no user query).
     """
     message = "Login required for site pages."
 
@@ -15,9 +14,9 @@ class IsSiteUser(BasePermission):
         if not (u and u.is_authenticated and getattr(u, "is_active", True)):
             return False
 
-        # If SiteUser is your concrete user model, we're done.
-        if get_user_model() is SiteUser:
-            return True
+        # token users carry the account type as a claim
+        user_type = getattr(u, "user_type", None)
+        if user_type is not None:
+            return user_type in ("site", "staff")
 
-        # (Fallback if SiteUser were a profile model; not your case)
-        return hasattr(u, "siteuser")
+        return isinstance(u, (SiteUser, StaffAdminUser))
@@ -0,0 +1,134 @@
+# dgp_bus/planner.py
+"""
+Capacity-aware assignment of bus passengers to vehicles and runs.
+
+Each timetable departure is a run served by every vehicle in settings.BUS_VEHICLES.
+Departures of one day and destination are filled in time order; a passenger who
+doesn't fit their own departure spills to the latest earlier departure that still
+has room (at most `max_spill` departures back), otherwise they are flagged for a taxi.
+The whole plan is a single pass over in-memory rows, so a week plans in milliseconds.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Appointment, Schedule
+from .timetable import DANISH_WEEKDAYS, schedule_destination_id
+
+APPOINTMENT_FIELDS = (
+    'id', 'appointment_date', 'appointment_time', 'hospital_id', 'accommodation__name',
+    'bus_time_manual', 'bus_time_computed', 'wheelchair', 'trolley', 'companion', 'has_taxi',
+)
+
+
+def _demand(appt):
+    # a wheelchair space replaces the passenger's seat; companions always need one
+    return (
+        (0 if appt['wheelchair'] else 1) + (1 if appt['companion'] else 0),
+        1 if appt['wheelchair'] else 0,
+        1 if appt['trolley'] else 0,
+    )
+
+
+class _Run:
+    def __init__(self, day, departure_time, destination_id, vehicles):
+        self.day = day
+        self.departure_time = departure_time
+        self.destination_id = destination_id
+        self.vehicles = [
+            {'name': v['name'], 'free': [v['seats'], v['wheelchairs'], v['trolleys']], 'passengers': []}
+            for v in vehicles
+        ]
+
+    def board(self, appt):
+        seats, wheelchairs, trolleys = _demand(appt)
+        for vehicle in self.vehicles:
+            free = vehicle['free']
+            if free[0] >= seats and free[1] >= wheelchairs and free[2] >= trolleys:
+                free[0] -= seats
+                free[1] -= wheelchairs
+                free[2] -= trolleys
+                vehicle['passengers'].append(appt['id'])
+                return True
+        return False
+
+    def as_dict(self, vehicles):
+        return {
+            'date': self.day,
+            'departure_time': self.departure_time,
+            'destination_id': self.destination_id,
+            'vehicles': [
+                {
+                    'name': v['name'],
+                    'passengers': v['passengers'],
+                    'seats_used': spec['seats'] - v['free'][0],
+                    'wheelchairs_used': spec['wheelchairs'] - v['free'][1],
+                    'trolleys_used': spec['trolleys'] - v['free'][2],
+                }
+                for v, spec in zip(self.vehicles, vehicles)
+            ],
+        }
+
+
+def plan_bus_assignments(appointments, departures, vehicles=None, max_spill=1):
+    """
+    Plan `appointments` (dicts with the APPOINTMENT_FIELDS keys) against `departures`,
+    a mapping of (destination_id, Danish weekday) -> sorted departure times.
+
+    Returns {'runs': [...], 'spilled': [...], 'taxi': [...]}; passengers who already
+    have a taxi or aren't served by bus are left out.
+    """
+    vehicles = settings.BUS_VEHICLES if vehicles is None else vehicles
+
+    # (day, destination) -> departure time -> waiting passengers
+    groups = {}
+    for appt in appointments:
+        bus_time = appt['bus_time_manual'] or appt['bus_time_computed']
+        if appt['has_taxi'] or bus_time is None:
+            continue
+        destination_id = schedule_destination_id(appt['hospital_id'], appt['accommodation__name']) or appt['hospital_id']
+        groups.setdefault((appt['appointment_date'], destination_id), {}).setdefault(bus_time, []).append(appt)
+
+    runs, spilled, taxi = [], [], []
+    for (day, destination_id), by_time in sorted(groups.items()):
+        # manual bus times that aren't in the timetable still get a run of their own
+        times = sorted(set(departures.get((destination_id, DANISH_WEEKDAYS[day.isoweekday()]), ())) | set(by_time))
+        day_runs = [_Run(day, t, destination_id, vehicles) for t in times]
+
+        for index, run in enumerate(day_runs):
+            waiting = sorted(
+                by_time.get(run.departure_time, ()),
+                key=lambda a: (not a['wheelchair'], not a['trolley'], a['appointment_time'], a['id']),
+            )
+            for appt in waiting:
+                if run.board(appt):
+                    continue
+                # earlier departures are the only feasible alternatives
+                for back in range(index - 1, max(index - 1 - max_spill, -1), -1):
+                    if day_runs[back].board(appt):
+                        spilled.append({'id': appt['id'], 'from': run.departure_time, 'to': times[back]})
+                        break
+                else:
+                    taxi.append(appt['id'])
+
+        runs.extend(r.as_dict(vehicles) for r in day_runs if any(v['passengers'] for v in r.vehicles))
+
+    return {'runs': runs, 'spilled': spilled, 'taxi': taxi}
+
+
+def plan_days(start, days=1, vehicles=None, max_spill=1):
+    """Load `days` days of appointments from `start` and plan them (two queries)."""
+    appointments = (
+        Appointment.objects
+        .filter(appointment_date__range=[start, start + timedelta(days=days - 1)])
+        .filter(Q(bus_time_manual__isnull=False) | Q(bus_time_computed__isnull=False), has_taxi=False)
+        .values(*APPOINTMENT_FIELDS)
+    )
+    departures = {}
+    for destination_id, day_of_week, departure_time in Schedule.objects.values_list(
+            'destination_id', 'day_of_week', 'departure_time'):
+        departures.setdefault((destination_id, day_of_week.capitalize()), []).append(departure_time)
+    for times in departures.values():
+        times.sort()
+    return plan_bus_assignments(appointments, departures, vehicles=vehicles, max_spill=max_spill)
@@ -0,0 +1,44 @@
+# dgp_bus/redis_scripts.py
+"""
+Lua scripts on the cache's Redis server, for the atomic steps Django's cache API lacks
+(the token buckets of dgp_bus.throttling, the lock release of dgp_bus.idempotency).
+
+The client is built from the cache's LOCATION (CACHE_URL) instead of borrowing the cache
+backend's private one. Keys get the cache's prefix and version, so scripts see what
+cache.add/cache.get wrote. Without a Redis cache (CACHE_URL=locmem://) the caller's
+in-process fallback runs instead.
+"""
+import redis
+from django.conf import settings
+from django.core.cache import caches
+
+_clients = {}
+_scripts = {}
+
+
+def redis_client():
+    """Client for the default cache's Redis server, or None when the cache isn't Redis."""
+    config = settings.CACHES['default']
+    if config['BACKEND'] != 'django.core.cache.backends.redis.RedisCache':
+        return None
+    url = config['LOCATION']
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = redis.Redis.from_url(url)
+    return client
+
+
+def run_script(source, keys, args, local):
+    """
+    Run the Lua `source` with the cache keys `keys` and `args` on Redis, or return
+    local(keys, args) when there is no Redis cache.
+    """
+    client = redis_client()
+    if client is None:
+        return local(keys, args)
+    script = _scripts.get(source)
+    if script is None:
+        # EVALSHA, falling back to loading the script once per Redis server
+        script = _scripts[source] = client.register_script(source)
+    cache = caches['default']
+    return script(keys=[cache.make_key(key) for key in keys], args=args, client=client)
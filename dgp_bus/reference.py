@@ -0,0 +1,75 @@
+# dgp_bus/reference.py
+"""
+Versioned cache of the reference tables: hospitals, accommodations and schedules.
+
+Each table is cached whole in Redis under its current revision (dgp_bus.revisions),
+which the save/delete signals and the CSV imports bump. In front of Redis every process
+keeps the rows it last loaded and re-reads the revision at most once per
+REFERENCE_CACHE_LOCAL_SECONDS, so most lookups cost neither a query nor a round trip.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Accommodation, Hospital, Schedule
+from .revisions import bump_revisions, get_revision
+
+SCOPES = {Hospital: 'hospitals', Accommodation: 'accommodations', Schedule: 'schedules'}
+KEY_PREFIX = 'ref:'
+TIMEOUT = 24 * 60 * 60  # superseded revisions just age out
+
+# scope -> (revision, checked at, rows, rows by pk)
+_local = {}
+
+
+def _load(model):
+    scope = SCOPES[model]
+    memo = _local.get(scope)
+    now = time.monotonic()
+    if memo is not None and now - memo[1] < settings.REFERENCE_CACHE_LOCAL_SECONDS:
+        return memo
+
+    # revision first: rows loaded after a concurrent bump are at least as new as it
+    revision = get_revision(scope)
+    if memo is not None and memo[0] == revision:
+        memo = _local[scope] = (revision, now, memo[2], memo[3])
+        return memo
+
+    key = f'{KEY_PREFIX}{scope}:{revision}'
+    rows = cache.get(key)
+    if rows is None:
+        # always the primary: a lagging replica would cache stale rows under the new revision
+        rows = tuple(model.objects.using(DEFAULT_DB_ALIAS).all())
+        cache.set(key, rows, timeout=TIMEOUT)
+    memo = _local[scope] = (revision, now, rows, {row.pk: row for row in rows})
+    return memo
+
+
+def reference_rows(model):
+    """All rows of a reference table, in the model's default order."""
+    return _load(model)[2]
+
+
+def reference_get(model, pk):
+    """The row with primary key `pk`, or None."""
+    row = _load(model)[3].get(pk)
+    if row is None:
+        # added in another process less than REFERENCE_CACHE_LOCAL_SECONDS ago?
+        row = model.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk).first()
+        if row is not None:
+            _local.pop(SCOPES[model], None)
+    return row
+
+
+def bump_reference(*models):
+    """New revision for the models' tables once the transaction commits."""
+    scopes = [SCOPES[model] for model in models]
+    bump_revisions(*scopes)
+
+    def forget():
+        # this process sees its own change right away, the others within REFERENCE_CACHE_LOCAL_SECONDS
+        for scope in scopes:
+            _local.pop(scope, None)
+    transaction.on_commit(forget)
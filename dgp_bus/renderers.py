@@ -0,0 +1,53 @@
+# dgp_bus/renderers.py
+"""
+Columnar JSON for the lobby boards.
+
+The boards poll the same few fields for hundreds of rows, and in plain JSON the
+repeated keys are most of the bytes. With `Accept: application/vnd.dgp.columnar+json`
+(or ?format=columnar) a list of rows is sent as the field names once and one array
+per column:
+
+    {"fields": ["id", "name", "hospital"], "rows": 2,
+     "columns": [[7, 9], ["Anne", "Inuk"], [0, 0]],
+     "dictionaries": {"hospital": ["Rigshospitalet"]}}
+
+Hospital and accommodation names are dictionary-encoded: their column holds indexes
+into dictionaries[field]. Anything that isn't a list of rows (errors) stays plain JSON.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+DICTIONARY_FIELDS = {'hospital', 'hospital_name', 'accommodation', 'accommodation_name'}
+
+
+def columnar(rows):
+    """A list of dicts with the same keys as {'fields', 'rows', 'columns', 'dictionaries'}."""
+    fields = list(rows[0]) if rows else []
+    columns, dictionaries = [], {}
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        # names only; the plain appointment fields 'hospital'/'accommodation' are ids
+        if field in DICTIONARY_FIELDS and all(v is None or isinstance(v, str) for v in values):
+            index = {}
+            values = [None if v is None else index.setdefault(v, len(index)) for v in values]
+            dictionaries[field] = list(index)
+        columns.append(values)
+    return {'fields': fields, 'rows': len(rows), 'columns': columns, 'dictionaries': dictionaries}
+
+
+class ColumnarRenderer(JSONRenderer):
+    media_type = 'application/vnd.dgp.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list):
+            data = columnar(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+def wants_columnar(request):
+    return isinstance(getattr(request, 'accepted_renderer', None), ColumnarRenderer)
+
+
+# plain JSON stays the default; columnar only when asked for
+BOARD_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarRenderer]
@@ -0,0 +1,46 @@
+# dgp_bus/revisions.py
+"""
+Change counters kept in the cache, one per scope (e.g. 'appointments').
+
+A revision is the time of the last committed change to its scope, so it can key
+cached responses and tells how recent that change is.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'rev:'
+
+
+def get_revisions(*scopes):
+    keys = [KEY_PREFIX + scope for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        # evicted or never set: start a new revision, which only costs a cache miss downstream
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def get_revision(scope):
+    return get_revisions(scope)[0]
+
+
+def _set_revisions(scopes):
+    try:
+        cache.set_many({KEY_PREFIX + scope: time.time() for scope in scopes}, timeout=None)
+    except Exception as e:
+        # the write has committed; a cache outage shouldn't turn it into an error response
+        print(f"[ERROR] Revision bump failed for {', '.join(scopes)}: {e}")
+
+
+def bump_revisions(*scopes):
+    """Start a new revision for the scopes once the current transaction commits."""
+    transaction.on_commit(lambda: _set_revisions(scopes))
+
+
+def day_scope(scope, day):
+    """Scope for one day (a date or ISO date string) of `scope`, e.g. 'appointments:2025-06-02'."""
+    return f'{scope}:{day}'
@@ -0,0 +1,61 @@
+# dgp_bus/ridership.py
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Coalesce
+
+from .models import Appointment, RidershipDay
+
+
+def rollup_day(day):
+    """Replace the rollup rows of `day` with fresh counts from the appointment table."""
+    rows = (
+        Appointment.objects
+        .filter(appointment_date=day)
+        .annotate(bus_time=Coalesce('bus_time_manual', 'bus_time_computed'))
+        .values('hospital_id', 'accommodation_id', 'bus_time')
+        .annotate(
+            appointments=Count('id'),
+            checked_in=Count('id', filter=Q(status=True)),
+            wheelchair=Count('id', filter=Q(wheelchair=True)),
+            trolley=Count('id', filter=Q(trolley=True)),
+            companion=Count('id', filter=Q(companion=True)),
+            translator=Count('id', filter=Q(translator=True)),
+            taxi=Count('id', filter=Q(has_taxi=True)),
+        )
+        .order_by()
+    )
+    rollups = [
+        RidershipDay(
+            date=day, weekday=day.isoweekday(),
+            hospital_id=r.pop('hospital_id'), accommodation_id=r.pop('accommodation_id'),
+            departure_time=r.pop('bus_time'), **r,
+        )
+        for r in rows
+    ]
+    with transaction.atomic():
+        RidershipDay.objects.filter(date=day).delete()
+        RidershipDay.objects.bulk_create(rollups)
+
+
+def rollup_ridership(until=None):
+    """
+    Roll up every finished day not rolled up yet, plus the last RIDERSHIP_REFRESH_DAYS
+    days again since check-ins and taxi flags can still change shortly after.
+    Must run before appointments are purged or archived. Returns the days rolled up.
+    """
+    until = until or date.today() - timedelta(days=1)
+    last = RidershipDay.objects.aggregate(last=Max('date'))['last']
+    if last is None:
+        first = Appointment.objects.aggregate(first=Min('appointment_date'))['first']
+        if first is None:
+            return []
+    else:
+        first = min(last + timedelta(days=1), until - timedelta(days=settings.RIDERSHIP_REFRESH_DAYS - 1))
+
+    days = [first + timedelta(days=n) for n in range((until - first).days + 1)]
+    for day in days:
+        rollup_day(day)
+    return days
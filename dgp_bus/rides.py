@@ -0,0 +1,125 @@
+# dgp_bus/rides.py
+"""
+Maintenance of the RideRun manifest.
+
+A day's runs are rebuilt as a unit whenever something on that day changes;
+a day holds at most a few dozen appointments, so this stays a handful of queries.
+"""
+from datetime import date, timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Appointment, RideRun, Schedule
+from .revisions import bump_revisions, day_scope
+from .timetable import schedule_destination_id, weekday_name
+
+REBUILD_PENDING_KEY = 'ride-runs-rebuild-pending'
+
+
+def horizon():
+    """Dates the manifest is kept for: today and the configured number of days ahead."""
+    today = date.today()
+    return today, today + timedelta(days=settings.RIDE_RUN_DAYS)
+
+
+def build_ride_runs(day):
+    """Group one day's bus passengers into unsaved RideRun rows."""
+    appts = (
+        Appointment.objects
+        .select_related('patient', 'hospital', 'accommodation')
+        .filter(appointment_date=day)
+        .filter(Q(bus_time_manual__isnull=False) | Q(bus_time_computed__isnull=False))
+        .order_by('appointment_time', 'id')
+    )
+    locations = {
+        (s.destination_id, s.departure_time): s.departure_location
+        for s in Schedule.objects.filter(day_of_week__iexact=weekday_name(day))
+    }
+
+    runs = {}
+    for a in appts:
+        accommodation_name = a.accommodation.name if a.accommodation else None
+        destination_id = schedule_destination_id(a.hospital_id, accommodation_name) or a.hospital_id
+        departure_time = a.bus_time_effective
+        location = a.departure_location or locations.get((destination_id, departure_time), '')
+
+        key = (departure_time, location, destination_id)
+        run = runs.get(key)
+        if run is None:
+            run = runs[key] = RideRun(
+                date=day, departure_time=departure_time,
+                departure_location=location, destination_id=destination_id,
+            )
+        run.passengers.append({
+            'id': a.id,
+            'name': a.patient.name,
+            'last_name': a.patient.last_name,
+            'room': a.patient.room,
+            'hospital': a.hospital.hospital_name,
+            'accommodation': accommodation_name,
+            'appointment_time': a.appointment_time.strftime('%H:%M'),
+            'status': a.status,
+            'has_taxi': a.has_taxi,
+            'wheelchair': a.wheelchair,
+            'trolley': a.trolley,
+            'companion': a.companion,
+            'translator': a.translator,
+        })
+        run.passenger_count += 1
+        run.wheelchair_count += a.wheelchair
+        run.trolley_count += a.trolley
+        run.companion_count += a.companion
+        run.translator_count += a.translator
+    return list(runs.values())
+
+
+def refresh_ride_runs(*days):
+    """Replace the stored runs of the given days with freshly built ones."""
+    for day in sorted(set(days)):
+        runs = build_ride_runs(day)
+        with transaction.atomic():
+            RideRun.objects.filter(date=day).delete()
+            RideRun.objects.bulk_create(runs)
+            bump_revisions('ride_runs', day_scope('ride_runs', day))
+
+
+def rebuild_ride_runs():
+    """Full rebuild of the horizon; also drops runs that fell out of it."""
+    start, end = horizon()
+    RideRun.objects.filter(Q(date__lt=start) | Q(date__gt=end)).delete()
+    refresh_ride_runs(*(start + timedelta(days=n) for n in range((end - start).days + 1)))
+
+
+def schedule_ride_refresh(*days):
+    """Refresh the given days once the surrounding transaction commits."""
+    start, end = horizon()
+    days = {d for d in days if d and start <= d <= end}
+    if days:
+        transaction.on_commit(partial(_refresh_quietly, days))
+
+
+def _refresh_quietly(days):
+    try:
+        refresh_ride_runs(*days)
+    except Exception as e:
+        # the write has committed; don't fail its response, the nightly rebuild repairs the manifest
+        print(f"[ERROR] Ride manifest refresh failed for {', '.join(map(str, sorted(days)))}: {e}")
+
+
+def _enqueue_rebuild():
+    from .tasks import rebuild_ride_runs as rebuild_task
+    try:
+        # one rebuild per burst of changes (e.g. a CSV import saving row by row)
+        if cache.add(REBUILD_PENDING_KEY, True, timeout=settings.RIDE_RUN_REBUILD_DELAY):
+            rebuild_task.apply_async(countdown=settings.RIDE_RUN_REBUILD_DELAY)
+    except Exception as e:
+        print(f"[ERROR] Could not queue the ride manifest rebuild: {e}")
+
+
+def schedule_ride_rebuild():
+    """Rebuild the whole horizon in Celery, RIDE_RUN_REBUILD_DELAY after the transaction commits."""
+    transaction.on_commit(_enqueue_rebuild)
@@ -1,11 +1,89 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Hospital, Schedule, Patient, Appointment, StaffAdminUser, Accommodation, SiteUser
-from datetime import datetime, timedelta
-import locale
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import (
+    Hospital, Schedule, Patient, Appointment, StaffAdminUser, Accommodation, SiteUser, RideRun, IDENTITY_FIELDS,
+)
 from .utils import site_user_password_reset_token
+from .authentication import account_claims, check_revoked
+from .timetable import schedule_destination_id, weekday_name, latest_departure
+from .reference import reference_get, reference_rows
 
 
+def parse_pk(model, data):
+    """`data` as a primary key of `model`, or None if it can't be one."""
+    if isinstance(data, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(data)
+    except DjangoValidationError:
+        return None
+
+
+class ReferenceRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField for a reference table, validated against the cached rows."""
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        pk = parse_pk(model, data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        row = reference_get(model, pk)
+        if row is None:
+            self.fail('does_not_exist', pk_value=data)
+        return row
+
+
+class PrefetchedRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField backed by a request-scoped identity map, context['prefetched'][model]
+    ({pk: row, or None if there is none}). Rows the caller already has, loaded in bulk or the
+    instance's own relations, cost no query; others are looked up once and remembered.
+    """
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        pk = parse_pk(model, data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        rows = self.context.setdefault('prefetched', {}).setdefault(model, {})
+        if pk not in rows:
+            rows[pk] = self.get_queryset().filter(pk=pk).first()
+        if rows[pk] is None:
+            self.fail('does_not_exist', pk_value=data)
+        return rows[pk]
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for a ModelSerializer: `fields=[...]` renders only those fields, and
+    only_columns() names the model columns they read, for QuerySet.only().
+    """
+    # columns read by fields without a source of their own (SerializerMethodFields)
+    method_field_columns = {}
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def readable_fields(cls):
+        return [name for name, field in cls().fields.items() if not field.write_only]
+
+    def only_columns(self):
+        columns = set()
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*':
+                columns.update(self.method_field_columns.get(name, ()))
+            else:
+                columns.add(field.source.replace('.', '__'))
+        return sorted(columns)
 
 
 class HospitalSerializer(serializers.ModelSerializer):
@@ -193,18 +271,56 @@ class SiteUserPasswordResetConfirmSerializer(serializers.Serializer):
 class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
-        fields = '__all__'
+        exclude = ('search_name', 'search_last_name', 'identity_key')
 
+    def validate(self, attrs):
+        # creates link to the existing patient instead (Patient.objects.update_or_create_identity)
+        if self.instance is not None:
+            identity = {f: attrs.get(f, getattr(self.instance, f)) for f in IDENTITY_FIELDS}
+            if any(identity[f] != getattr(self.instance, f) for f in IDENTITY_FIELDS):
+                other = Patient(pk=self.instance.pk, **identity).identity_conflict()
+                if other is not None:
+                    raise serializers.ValidationError(
+                        f'Patient #{other.pk} already has this name, last name and birth date.')
+        return attrs
+
+
+class UpcomingAppointmentSerializer(serializers.ModelSerializer):
+    """An appointment nested under its patient (patients/?expand=appointments)."""
+    hospital_name = serializers.CharField(source='hospital.hospital_name', read_only=True)
+    accommodation_name = serializers.SerializerMethodField(read_only=True)
+    bus_time_effective = serializers.TimeField(read_only=True)
+
+    class Meta:
+        model = Appointment
+        fields = (
+            'id', 'appointment_date', 'appointment_time', 'bus_time_effective',
+            'hospital', 'hospital_name', 'accommodation', 'accommodation_name', 'department',
+            'departure_location', 'status', 'has_taxi', 'translator', 'wheelchair', 'trolley', 'companion',
+            'description',
+        )
+
+    def get_accommodation_name(self, obj):
+        return obj.accommodation.name if obj.accommodation else None
 
-class AppointmentSerializer(serializers.ModelSerializer):
+
+class PatientWithAppointmentsSerializer(PatientSerializer):
+    # filled by the viewset's Prefetch, see PatientViewSet.get_queryset
+    appointments = UpcomingAppointmentSerializer(source='upcoming_appointments', many=True, read_only=True)
+
+    class Meta(PatientSerializer.Meta):
+        pass
+
+
+class AppointmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # ---------- write via IDs ----------
-    patient_id = serializers.PrimaryKeyRelatedField(
+    patient_id = PrefetchedRelatedField(
         queryset=Patient.objects.all(), source='patient', write_only=True
     )
-    hospital_id = serializers.PrimaryKeyRelatedField(
+    hospital_id = ReferenceRelatedField(
         queryset=Hospital.objects.all(), source='hospital', write_only=True
     )
-    accommodation_id = serializers.PrimaryKeyRelatedField(
+    accommodation_id = ReferenceRelatedField(
         queryset=Accommodation.objects.all(), source='accommodation',
         write_only=True, required=False, allow_null=True
     )
@@ -231,6 +347,18 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'accommodation': {'read_only': True},
         }
 
+    method_field_columns = {
+        'accommodation_name': ('accommodation__name',),
+        'bus_time_effective': ('bus_time_manual', 'bus_time_computed'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # an update that sends the current patient_id again needs no lookup
+        if isinstance(self.instance, Appointment) and Appointment.patient.is_cached(self.instance):
+            patients = self.context.setdefault('prefetched', {}).setdefault(Patient, {})
+            patients.setdefault(self.instance.patient_id, self.instance.patient)
+
     # ---------- display helpers ----------
     def get_accommodation_name(self, obj):
         return obj.accommodation.name if obj.accommodation else None
@@ -244,61 +372,55 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if not (hospital and accommodation and appointment_date and appointment_time):
             return None
 
-        # Locale can be missing on server; don't crash if it is
-        try:
-            locale.setlocale(locale.LC_TIME, 'da_DK.UTF-8')
-        except Exception:
-            pass
-
-        # Business rule
-        if hospital.id in [1, 3, 7, 10] and getattr(accommodation, 'name', '') == 'Det grønlandske Patienthjem':
-            day_of_week = appointment_date.strftime('%A')
-            schedule_hospital_id = 1 if hospital.id in [3, 7, 10] else hospital.id
-
-            schedules = Schedule.objects.filter(
-                destination_id=schedule_hospital_id,
-                day_of_week=day_of_week
-            )
-
-            travel_time = timedelta(minutes=30)
-            latest_departure = (datetime.combine(appointment_date, appointment_time) - travel_time).time()
-
-            chosen = None
-            for s in schedules:
-                if s.departure_time <= latest_departure and (chosen is None or s.departure_time > chosen.departure_time):
-                    chosen = s
-            return chosen.departure_time if chosen else None
+        destination_id = schedule_destination_id(hospital.id, getattr(accommodation, 'name', ''))
+        if destination_id is None:
+            return None
 
-        return None
+        # latest departure that day that still makes it, from the cached timetable
+        day = weekday_name(appointment_date).lower()
+        latest = latest_departure(appointment_date, appointment_time)
+        if latest is None:
+            return None
+        return max(
+            (s.departure_time for s in reference_rows(Schedule)
+             if s.destination_id == destination_id and s.day_of_week.lower() == day and s.departure_time <= latest),
+            default=None,
+        )
 
     def _resolve_inputs(self, instance, v):
         """
         Resolve inputs from incoming validated data (v) or fall back to instance fields.
         """
-        hospital = v.get('hospital') or getattr(instance, 'hospital', None)
-        accommodation = v.get('accommodation') or getattr(instance, 'accommodation', None)
+        # the instance's hospital/accommodation from the reference cache, not its relations
+        hospital = v.get('hospital') or (instance and reference_get(Hospital, instance.hospital_id))
+        accommodation = v.get('accommodation') or (
+            instance and instance.accommodation_id and reference_get(Accommodation, instance.accommodation_id))
         d = v.get('appointment_date') or getattr(instance, 'appointment_date', None)
         t = v.get('appointment_time') or getattr(instance, 'appointment_time', None)
         return hospital, accommodation, d, t
 
     # ---------- lifecycle ----------
-    def create(self, validated_data):
-        # If the client didn’t set a manual bus time, compute one
-        if not validated_data.get('bus_time_manual'):
-            hospital, accommodation, d, t = self._resolve_inputs(None, validated_data)
-            bt = self._compute_bus_time(hospital=hospital, accommodation=accommodation,
-                                        appointment_date=d, appointment_time=t)
-            if bt is not None:
-                validated_data['bus_time_computed'] = bt
-        return super().create(validated_data)
+    def with_bus_time(self, instance, validated_data):
+        """
+        validated_data plus the bus time fields a create (instance None) or update should
+        write. Shared with the bulk endpoint, which saves the rows itself.
+        """
+        if instance is None:
+            # If the client didn’t set a manual bus time, compute one
+            if not validated_data.get('bus_time_manual'):
+                hospital, accommodation, d, t = self._resolve_inputs(None, validated_data)
+                bt = self._compute_bus_time(hospital=hospital, accommodation=accommodation,
+                                            appointment_date=d, appointment_time=t)
+                if bt is not None:
+                    validated_data['bus_time_computed'] = bt
+            return validated_data
 
-    def update(self, instance, validated_data):
         manual_provided = 'bus_time_manual' in validated_data and validated_data.get('bus_time_manual') not in (None, '')
         manual_cleared = 'bus_time_manual' in validated_data and validated_data.get('bus_time_manual') in (None, '')
 
         if manual_provided:
             # Respect manual override; do not touch computed here
-            return super().update(instance, validated_data)
+            return validated_data
 
         # Either manual was cleared or inputs may have changed — recompute
         hospital, accommodation, d, t = self._resolve_inputs(instance, validated_data)
@@ -311,15 +433,21 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if bt is not None:
             validated_data['bus_time_computed'] = bt
 
-        return super().update(instance, validated_data)
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self.with_bus_time(None, validated_data))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self.with_bus_time(instance, validated_data))
 
 
 
 class BusTimeInputSerializer(serializers.Serializer):
-    hospital_id = serializers.PrimaryKeyRelatedField(
+    hospital_id = ReferenceRelatedField(
         queryset=Hospital.objects.all(), source='hospital'
     )
-    accommodation_id = serializers.PrimaryKeyRelatedField(
+    accommodation_id = ReferenceRelatedField(
         queryset=Accommodation.objects.all(), source='accommodation'
     )
     appointment_date = serializers.DateField()
@@ -353,19 +481,71 @@ class AppointmentPublicSerializer(serializers.ModelSerializer):
         return t.strftime('%H:%M:%S') if t else None
     
 class BusTimeInputSerializer(serializers.Serializer):
-    hospital_id = serializers.PrimaryKeyRelatedField(
+    hospital_id = ReferenceRelatedField(
         queryset=Hospital.objects.all(), source='hospital'
     )
-    accommodation_id = serializers.PrimaryKeyRelatedField(
+    accommodation_id = ReferenceRelatedField(
         queryset=Accommodation.objects.all(), source='accommodation'
     )
     appointment_date = serializers.DateField()
     appointment_time = serializers.TimeField()
 
 
+class CheckInSerializer(serializers.Serializer):
+    """Bulk check-in: a list of appointment ids, or a departure (date and bus time)."""
+    status = serializers.BooleanField(default=True)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=1000)
+    date = serializers.DateField(required=False)
+    departure_time = serializers.TimeField(required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('date' in attrs and 'departure_time' in attrs):
+            raise serializers.ValidationError('Give either ids or date and departure_time.')
+        return attrs
+
+
+class RideRunSerializer(serializers.ModelSerializer):
+    destination_name = serializers.CharField(source='destination.hospital_name', read_only=True)
+
+    class Meta:
+        model = RideRun
+        fields = [
+            'date', 'departure_time', 'departure_location', 'destination', 'destination_name',
+            'passenger_count', 'wheelchair_count', 'trolley_count', 'companion_count', 'translator_count',
+            'passengers',
+        ]
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # claims request.user is built from, see dgp_bus.authentication
+        token = super().get_token(user)
+        for claim, value in account_claims(user).items():
+            token[claim] = value
+        return token
+
     def validate(self, attrs):
         # Replace 'username' with 'email' in the authentication process
         attrs['username'] = attrs.get('email', '')
         return super().validate(attrs)
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # the new access token copies the refresh token's claims, so honour its revocation
+        try:
+            check_revoked(RefreshToken(attrs['refresh']))
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        return super().validate(attrs)
+
+
+class TokenRevokeSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value):
+        try:
+            return RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(e.args[0])
@@ -0,0 +1,95 @@
+# dgp_bus/signals.py
+from datetime import date
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import revoke_account
+from .backends import negative_cache_key
+from .models import Appointment, AppointmentTombstone, Patient, Schedule, Hospital, Accommodation, SiteUser, StaffAdminUser
+from .rides import schedule_ride_refresh, schedule_ride_rebuild, horizon
+from .reference import bump_reference
+from .revisions import bump_revisions, day_scope
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, **kwargs):
+    days = {instance.appointment_date, getattr(instance, '_loaded_appointment_date', None)} - {None}
+    bump_revisions('appointments', *(day_scope('appointments', day) for day in days))
+    schedule_ride_refresh(*days)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    bump_revisions('appointments', day_scope('appointments', instance.appointment_date))
+    # delta sync covers upcoming appointments only; archival and purges of past days stay quiet
+    if instance.appointment_date >= date.today():
+        AppointmentTombstone.objects.create(appointment_id=instance.pk, appointment_date=instance.appointment_date)
+    schedule_ride_refresh(instance.appointment_date)
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, **kwargs):
+    # appointment responses embed patient fields
+    bump_revisions('patients')
+    # name and room are copied into the manifest
+    if created:
+        return
+    # ...and into the delta sync rows
+    instance.appointments.filter(appointment_date__gte=date.today()).update(updated_at=timezone.now())
+    start, end = horizon()
+    days = instance.appointments.filter(appointment_date__range=[start, end]).dates('appointment_date', 'day')
+    schedule_ride_refresh(*days)
+
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, **kwargs):
+    bump_revisions('patients')
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_save, sender=Hospital)
+@receiver(post_save, sender=Accommodation)
+def timetable_changed(sender, **kwargs):
+    # reference data changes rarely; rebuild the whole horizon, once per burst of changes
+    schedule_ride_rebuild()
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+@receiver(post_save, sender=Accommodation)
+@receiver(post_delete, sender=Accommodation)
+def reference_changed(sender, **kwargs):
+    bump_reference(sender)
+
+
+# changing these invalidates the claims in the account's tokens
+TOKEN_CLAIM_FIELDS = ('password', 'is_active', 'is_staff', 'role', 'is_frontdesk')
+
+
+@receiver(pre_save, sender=StaffAdminUser)
+@receiver(pre_save, sender=SiteUser)
+def account_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    fields = [f.name for f in sender._meta.concrete_fields if f.name in TOKEN_CLAIM_FIELDS]
+    if update_fields is not None:
+        fields = [f for f in fields if f in update_fields]
+    instance._revoke_tokens = False
+    if raw or instance.pk is None or not fields:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._revoke_tokens = old is not None and any(old[f] != getattr(instance, f) for f in fields)
+
+
+@receiver(post_save, sender=StaffAdminUser)
+@receiver(post_save, sender=SiteUser)
+def account_saved(sender, instance, **kwargs):
+    # an email remembered as unknown may belong to this account now
+    cache.delete(negative_cache_key(instance.email))
+    if getattr(instance, '_revoke_tokens', False):
+        transaction.on_commit(lambda: revoke_account(instance))
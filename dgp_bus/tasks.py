@@ -1,14 +1,54 @@
 from datetime import timedelta
 from django.utils import timezone
 from celery import shared_task
-from .models import Patient
+from .models import AppointmentTombstone, Patient
 from django.core.mail import send_mail
 from django.conf import settings
+from .rides import rebuild_ride_runs as _rebuild_ride_runs
+from .ridership import rollup_ridership as _rollup_ridership
+from .archive import archive_appointments as _archive_appointments
+from .partitions import is_partitioned, maintain_partitions
 
 @shared_task
 def delete_expired_entries():
+    # keep the ridership history of the appointments about to be deleted
+    _rollup_ridership()
     threshold_date = timezone.now() - timedelta(days=30)
-    Patient.objects.filter(created_at__lt=threshold_date).delete()  # Deletes the entire row
+    # returning patients keep their original created_at, so spare anyone with a recent or upcoming appointment
+    (Patient.objects
+     .filter(created_at__lt=threshold_date)
+     .exclude(appointments__appointment_date__gte=threshold_date.date())
+     .delete())  # Deletes the entire row
+    AppointmentTombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(days=settings.APPOINTMENT_TOMBSTONE_DAYS)
+    ).delete()
+
+
+@shared_task
+def rebuild_ride_runs():
+    # safety net for the incremental maintenance in dgp_bus.signals
+    _rebuild_ride_runs()
+
+
+@shared_task
+def rollup_ridership():
+    days = _rollup_ridership()
+    print(f"[INFO] Rolled up ridership for {len(days)} day(s)")
+
+
+@shared_task
+def archive_appointments():
+    if is_partitioned():
+        # old months leave by partition drop in maintain_appointment_partitions
+        return
+    moved = _archive_appointments()
+    print(f"[INFO] Archived {moved} appointment(s)")
+
+
+@shared_task
+def maintain_appointment_partitions():
+    added, dropped = maintain_partitions()
+    print(f"[INFO] Appointment partitions added: {added or 'none'}, dropped: {dropped or 'none'}")
 
 
 @shared_task
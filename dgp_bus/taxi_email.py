@@ -1,44 +1,39 @@
 # taxi_email.py
-import requests
-from django.conf import settings
+from datetime import date, timedelta
 from celery import shared_task
-from .models import SiteUser
+from .db_router import replica_reads
+from .models import Appointment, SiteUser
 from .tasks import send_smtp_email
 
 @shared_task
 def send_taxi_user_report():
+    # straight from the read replica rather than through our own HTTP API
+    today = date.today()
+    with replica_reads():
+        appointments = list(
+            Appointment.objects.select_related('patient', 'hospital', 'accommodation')
+            .without_bus_time()
+            .filter(appointment_date__range=[today, today + timedelta(days=120)], has_taxi=False)
+        )
+    print(f"[DEBUG] Patients without taxi: {len(appointments)}")
 
-    try:
-        response = requests.get(f"{settings.BASE_URL}/api/patients/taxi-users")
-        response.raise_for_status()
-        patients = response.json()
-    except requests.RequestException as e:
-        print(f"[ERROR] Failed to fetch patient data: {e}")
-        return
-
-    patients_without_taxi = [p for p in patients if not p.get("has_taxi", False)]
-    print(f"[DEBUG] Patients without taxi: {len(patients_without_taxi)}")
-
-    if not patients_without_taxi:
+    if not appointments:
         print("[INFO] No patients without taxi to report.")
         return
 
     # Compose message
     message = "Patienter uden taxa\n\n"
-    for patient in patients_without_taxi:
-        name = patient.get('name', 'Ukendt')
-        accommodation = patient.get('accommodation', {}).get("name", "N/A")
-        hospital = patient.get('hospital_name', 'UkendtHospital')
-        appointment = patient.get('appointment_time', 'Ingen aftale')
-
-        if appointment != 'Ingen aftale':
-            appointment = appointment[:5]  # Trim to HH:MM
+    for appointment in appointments:
+        name = appointment.patient.name or 'Ukendt'
+        accommodation = appointment.accommodation.name if appointment.accommodation else "N/A"
+        hospital = appointment.hospital.hospital_name
+        appointment_time = appointment.appointment_time.strftime('%H:%M')
 
         message += (
             f"- {name}\n"
             f"  Indkvartering: {accommodation}\n"
             f"  Hospital: {hospital}\n"
-            f"  Tid på hospitalet: {appointment}\n\n"
+            f"  Tid på hospitalet: {appointment_time}\n\n"
         )
 
     # Get the list of front desk users
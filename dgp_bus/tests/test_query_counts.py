@@ -0,0 +1,100 @@
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from dgp_bus import reference
+from dgp_bus.models import Accommodation, Appointment, Hospital, Patient, Schedule, StaffAdminUser
+from dgp_bus.serializers import AppointmentSerializer
+from dgp_bus.views import PatientViewSet
+
+# never the shared Redis: the reference cache would keep rows of the test database
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class AppointmentWriteQueriesTest(TestCase):
+    """Appointment writes through AppointmentSerializer, response included; the manifest refresh runs after commit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(hospital_name='Rigshospitalet', address='-')
+        cls.accommodation = Accommodation.objects.create(name='Patienthjem', accType='-')
+        cls.patients = [Patient.objects.create(name=f'Count{i}', last_name='Check', room=str(i)) for i in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        reference._local.clear()
+        for model in (Hospital, Accommodation, Schedule):
+            reference.reference_rows(model)  # warm, as in a running server
+        self.data = {
+            'patient_id': self.patients[0].pk, 'hospital_id': self.hospital.pk,
+            'accommodation_id': self.accommodation.pk,
+            'appointment_date': date.today() + timedelta(days=3), 'appointment_time': '11:30',
+        }
+
+    def save(self, data, instance=None):
+        if instance is not None:
+            # what the viewset's get_object() loads
+            instance = Appointment.objects.select_related('patient', 'hospital', 'accommodation').get(pk=instance.pk)
+        serializer = AppointmentSerializer(instance, data=data, partial=instance is not None)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        serializer.data
+        return serializer.instance
+
+    def test_create(self):
+        # patient lookup, INSERT
+        with self.assertNumQueries(2):
+            self.save(self.data)
+
+    def test_update(self):
+        appointment = self.save(self.data)
+        # the appointment with its relations, UPDATE
+        with self.assertNumQueries(2):
+            self.save({'patient_id': self.patients[0].pk, 'appointment_time': '12:00'}, appointment)
+
+    def test_update_patient(self):
+        appointment = self.save(self.data)
+        # plus the new patient
+        with self.assertNumQueries(3):
+            self.save({'patient_id': self.patients[1].pk}, appointment)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ExpandedPatientListQueriesTest(TestCase):
+    """?expand=appointments costs the same two queries for any number of patients."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(hospital_name='Rigshospitalet', address='-')
+        cls.accommodation = Accommodation.objects.create(name='Patienthjem', accType='-')
+
+    def setUp(self):
+        cache.clear()
+
+    def add_patients(self, count):
+        for i in range(count):
+            patient = Patient.objects.create(name=f'Count{i}', last_name='Check', room=str(i))
+            for days in (1, 2):
+                Appointment.objects.create(
+                    patient=patient, hospital=self.hospital, accommodation=self.accommodation,
+                    appointment_date=date.today() + timedelta(days=days), appointment_time='10:00',
+                )
+
+    def list_patients(self):
+        request = APIRequestFactory().get('/api/patients/', {'expand': 'appointments'})
+        force_authenticate(request, user=StaffAdminUser(email='check@localhost'))
+        response = PatientViewSet.as_view({'get': 'list'})(request)
+        response.render()
+        return response
+
+    def test_expanded_list(self):
+        for count in (5, 20):
+            self.add_patients(count)
+            # patients, and their upcoming appointments with hospital and accommodation
+            with self.assertNumQueries(2):
+                response = self.list_patients()
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(all(len(p['appointments']) == 2 for p in response.data))
@@ -0,0 +1,153 @@
+import random
+import re
+from datetime import date, time, timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from dgp_bus.models import Accommodation, Appointment, Hospital, Patient, RideRun, Schedule
+from dgp_bus.timetable import BUS_ACCOMMODATION_NAME, BUS_SCHEDULE_DESTINATIONS, DANISH_WEEKDAYS
+
+# tiny lookup tables; scanning them is cheaper than any index
+REFERENCE_TABLES = {m._meta.db_table for m in (Hospital, Accommodation, Schedule)}
+
+SQLITE_STEP = re.compile(r'^(SCAN|SEARCH) (\S+)(?: AS \S+)?(?: USING (?:COVERING |PRIMARY KEY|INTEGER PRIMARY KEY)?(?:INDEX (\S+))?)?')
+
+BY_DATE = (Appointment, ['appointment_date'])
+MISSING_BUS_TIME = (Appointment, ['bus_time_manual', 'bus_time_computed', 'appointment_date'])
+# None stands for an expression, here lower(day_of_week)
+SCHEDULE_DEPARTURE = (Schedule, ['destination_id', None])
+
+
+def translator_index():
+    # SQLite compiles translator=True to the bare column, which no index serves; the date range still does
+    if connection.vendor == 'sqlite':
+        return BY_DATE
+    return (Appointment, ['translator', 'appointment_date'])
+
+
+def hot_queries(today):
+    """
+    (name, queryset, (model, columns), ...) for the endpoints that carry the load; for each
+    (model, columns) the plan must use an index of the model's table whose leading columns
+    are `columns`.
+    """
+    appts = Appointment.objects.select_related('patient', 'hospital', 'accommodation')
+    return [
+        ('rides-today', appts.filter(appointment_date=today), BY_DATE),
+        ('alle-aftaler', appts.filter(appointment_date__gte=today).order_by('appointment_date', 'appointment_time'),
+         BY_DATE),
+        ('translator-view', appts.for_translators(today, today + timedelta(days=5)), translator_index()),
+        ('public-taxi-users', appts.without_bus_time().filter(appointment_date__range=[today, today + timedelta(days=1)]),
+         MISSING_BUS_TIME),
+        ('taxi-users', appts.without_bus_time().filter(appointment_date__range=[today, today + timedelta(days=120)]),
+         MISSING_BUS_TIME),
+        ('find-patient', appts.for_patient('Anne', '101', 'Det grønlandske Patienthjem')
+         .filter(appointment_date__gte=today).order_by('appointment_date', 'appointment_time'),
+         (Patient, ['search_name', 'room'])),
+        ('patient-search', Patient.objects.search('møller an').order_by('search_name', 'search_last_name')[:25],
+         (Patient, ['search_name'])),
+        ('load-forecast', Appointment.objects.filter(appointment_date__range=[today, today + timedelta(days=13)])
+         .departure_loads(), BY_DATE, SCHEDULE_DEPARTURE),
+        ('appointment-changes', appts.filter(updated_at__gt=timezone.now() - timedelta(minutes=1)),
+         (Appointment, ['updated_at'])),
+        ('ride-runs', RideRun.objects.select_related('destination').filter(date__range=[today, today + timedelta(days=7)]),
+         (RideRun, ['date'])),
+    ]
+
+
+def index_columns(table, index):
+    """Columns of `index` if it is an index of `table` (the plan may name the table by an alias), else []."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s AND tbl_name = %s",
+                           [index, table])
+            if cursor.fetchone() is None:
+                return []
+            # also covers the autoindexes SQLite creates for UNIQUE constraints
+            cursor.execute(f'PRAGMA index_info({connection.ops.quote_name(index)})')
+            return [row[2] for row in cursor.fetchall()]
+        return connection.introspection.get_constraints(cursor, table).get(index, {}).get('columns', [])
+
+
+def explain(queryset):
+    """[(table, index or None, full scan?)] for each step of the plan."""
+    sql, params = queryset.query.sql_with_params()
+    steps = []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            for *_, detail in cursor.fetchall():
+                match = SQLITE_STEP.match(detail)
+                if match:
+                    op, table, index = match.groups()
+                    steps.append((table, index, op == 'SCAN'))
+        elif connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [c[0] for c in cursor.description]
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                # ALL is a table scan, index a scan of a whole index
+                steps.append((row['table'], row['key'], row['type'] in ('ALL', 'index')))
+        else:
+            raise NotImplementedError(f'No EXPLAIN support for {connection.vendor}')
+    return steps
+
+
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN the hot appointment queries against generated appointments, timetable and ride
+    runs; fail when one scans a whole table or misses its index.
+    """
+    SEED = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1)
+        hospital = Hospital.objects.create(pk=next(iter(BUS_SCHEDULE_DESTINATIONS)), hospital_name='Rigshospitalet', address='-')
+        accommodation = Accommodation.objects.create(name=BUS_ACCOMMODATION_NAME, accType='-')
+        patients = [Patient.objects.create(name=f'Seed{i}', last_name='Plan', room=str(i)) for i in range(cls.SEED // 5)]
+        today = date.today()
+        departures = [time(h, m) for h in range(6, 16) for m in (0, 30)]
+        Schedule.objects.bulk_create(
+            [Schedule(destination=hospital, day_of_week=day, departure_time=t, departure_location=f'Seed stop {day}')
+             for day in DANISH_WEEKDAYS.values() for t in departures]
+        )
+        # a manifest for every seeded day, as rides.refresh_ride_runs keeps it
+        RideRun.objects.bulk_create(
+            [RideRun(date=today + timedelta(days=n), departure_time=t, departure_location='Seed stop', destination=hospital)
+             for n in range(-60, 181) for t in departures[::4]],
+            batch_size=1000,
+        )
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=rng.choice(patients), hospital=hospital, accommodation=accommodation,
+                    appointment_date=today + timedelta(days=rng.randint(-60, 180)),
+                    appointment_time=time(rng.randint(7, 15), rng.choice([0, 15, 30, 45])),
+                    bus_time_computed=None if rng.random() < 0.1 else time(6, 30),
+                    translator=rng.random() < 0.1,
+                )
+                for _ in range(cls.SEED)
+            ],
+            batch_size=1000,
+        )
+        if connection.vendor == 'sqlite':
+            # MySQL's ANALYZE TABLE would commit the seed; InnoDB refreshes its statistics itself
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def test_hot_queries_use_their_indexes(self):
+        for name, queryset, *expected in hot_queries(date.today()):
+            with self.subTest(name):
+                steps = explain(queryset)
+                used = [index for _, index, _ in steps if index]
+                plan = ', '.join(f'{t}:{index or "-"}{" (scan)" if full else ""}' for t, index, full in steps)
+                scans = [t for t, _, full in steps if full and t not in REFERENCE_TABLES]
+                self.assertEqual(scans, [], f'{name} scans a whole table: {plan}')
+                for model, columns in expected:
+                    table = model._meta.db_table
+                    self.assertTrue(
+                        any(index_columns(table, index)[:len(columns)] == columns for index in used),
+                        f'{name} uses no index on {table}({", ".join(map(str, columns))}): {plan}',
+                    )
@@ -0,0 +1,130 @@
+# dgp_bus/throttling.py
+"""
+Token-bucket throttling for the anonymous and credential endpoints.
+
+A view names its scope (`throttle_scope`, or `throttle_scopes` per viewset action)
+and REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] holds '<scope>.ip' and '<scope>.account'
+rates. 'N/period' means bursts of up to N requests, refilled at N per period.
+
+All buckets of a request are checked and charged by one Lua script, i.e. a single
+Redis round trip; a request is only charged when every bucket has a token. Without a
+Redis cache (CACHE_URL=locmem://) the buckets live in process memory.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from rest_framework.throttling import SimpleRateThrottle
+
+from .redis_scripts import run_script
+
+KEY_PREFIX = 'throttle:'
+
+TAKE_TOKENS = """
+local now = tonumber(ARGV[1])
+local state, wait = {}, 0
+for i, key in ipairs(KEYS) do
+  local capacity, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(bucket[1]) or capacity
+  local ts = tonumber(bucket[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+  if tokens < 1 then wait = math.max(wait, (1 - tokens) / rate) end
+  state[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+  local capacity, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  local tokens = state[i]
+  if wait == 0 then tokens = tokens - 1 end
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', ARGV[1])
+  redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+end
+return tostring(wait)
+"""
+
+_local_buckets = {}
+_local_lock = threading.Lock()
+
+
+def _take_local(keys, args):
+    # the script's arguments: now, then capacity and rate per key
+    now = args[0]
+    buckets = list(zip(keys, args[1::2], args[2::2]))
+    with _local_lock:
+        state, wait = [], 0.0
+        for key, capacity, rate in buckets:
+            tokens, ts = _local_buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            state.append(tokens)
+        for (key, _, _), tokens in zip(buckets, state):
+            _local_buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+    return wait
+
+
+def take_tokens(buckets):
+    """
+    Take one token from each of `buckets` [(key, capacity, refill per second)], all or none.
+    Returns 0 when allowed, otherwise the seconds until every bucket has a token again.
+    """
+    args = [time.time()]
+    for _, capacity, rate in buckets:
+        args += [capacity, rate]
+    try:
+        return float(run_script(TAKE_TOKENS, [KEY_PREFIX + key for key, _, _ in buckets], args, _take_local))
+    except Exception as e:
+        # a Redis outage shouldn't take the public endpoints down with it
+        print(f"[ERROR] Throttle check failed, allowing request: {e}")
+        return 0.0
+
+
+def _scope(view):
+    scopes = getattr(view, 'throttle_scopes', None)
+    if scopes is not None:
+        return scopes.get(getattr(view, 'action', None))
+    return getattr(view, 'throttle_scope', None)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Per-IP and per-account token buckets for the view's throttle scope."""
+
+    def __init__(self):
+        # rates depend on the view, see allow_request
+        self._wait = 0
+
+    def account_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            # staff and site user ids overlap
+            return f"user:{getattr(request.user, 'user_type', type(request.user).__name__)}:{request.user.pk}"
+        # credential endpoints: the account being logged into or reset
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if isinstance(email, str) and email.strip():
+            return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return None
+
+    def allow_request(self, request, view):
+        scope = _scope(view)
+        if scope is None:
+            return True
+
+        buckets = []
+        for kind in ('ip', 'account'):
+            rate = self.THROTTLE_RATES.get(f'{scope}.{kind}')
+            if rate is None:
+                continue
+            ident = self.get_ident(request) if kind == 'ip' else self.account_ident(request)
+            if ident is None:
+                continue
+            capacity, duration = self.parse_rate(rate)
+            buckets.append((f'{scope}.{kind}:{ident}', capacity, capacity / duration))
+        if not buckets:
+            return True
+
+        self._wait = take_tokens(buckets)
+        return self._wait == 0
+
+    def wait(self):
+        # Retry-After is rendered as a whole number of seconds; round up so it is never 0
+        return math.ceil(self._wait)
@@ -0,0 +1,47 @@
+# dgp_bus/timetable.py
+"""
+Bus routing rule shared by the serializer, the SQL annotations and the reports.
+
+Only residents of the patient home are driven by bus, and the Rigshospitalet
+satellite sites share the Blegdamsvej timetable (destination 1).
+"""
+from datetime import datetime, timedelta
+
+BUS_ACCOMMODATION_NAME = 'Det grønlandske Patienthjem'
+
+# appointment hospital id -> Schedule.destination_id
+BUS_SCHEDULE_DESTINATIONS = {1: 1, 3: 1, 7: 1, 10: 1}
+
+# time from departure until the patient is at the hospital
+BUS_TRAVEL_TIME = timedelta(minutes=30)
+
+# Schedule.day_of_week values, indexed by date.isoweekday()
+DANISH_WEEKDAYS = {
+    1: 'Mandag',
+    2: 'Tirsdag',
+    3: 'Onsdag',
+    4: 'Torsdag',
+    5: 'Fredag',
+    6: 'Lørdag',
+    7: 'Søndag',
+}
+
+
+def weekday_name(d):
+    return DANISH_WEEKDAYS[d.isoweekday()]
+
+
+def schedule_destination_id(hospital_id, accommodation_name):
+    """Timetable destination for a trip, or None when the trip isn't served by bus."""
+    if accommodation_name != BUS_ACCOMMODATION_NAME:
+        return None
+    return BUS_SCHEDULE_DESTINATIONS.get(hospital_id)
+
+
+def latest_departure(appointment_date, appointment_time):
+    """
+    Latest departure that still reaches the hospital in time, or None when it would be
+    the evening before (no bus, as in AppointmentQuerySet.with_expected_bus_time).
+    """
+    latest = datetime.combine(appointment_date, appointment_time) - BUS_TRAVEL_TIME
+    return latest.time() if latest.date() == appointment_date else None
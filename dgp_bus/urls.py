@@ -13,9 +13,12 @@ from .views import (
     SiteUserPasswordResetValidateView,
     SiteUserInviteView,
     SiteUserInviteConfirmView,
+    RidershipView,
+    ThrottledTokenObtainPairView,
+    TokenRevokeView,
     public_test_view,
 )
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 # Initialize the DefaultRouter for viewsets
 router = DefaultRouter()
@@ -34,11 +37,13 @@ urlpatterns = [
     # Include all the viewset routes registered with the router under the 'api/' prefix
     path('api/', include(router.urls)),
     path('api/patients/rides/today/', get_today_rides, name='get_today_rides'),
+    path('api/ridership/', RidershipView.as_view(), name='ridership'),
 
 
     # JWT Token authentication endpoints
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  
+    path('api/token/', ThrottledTokenObtainPairView.as_view(), name='token_obtain_pair'),  
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  
+    path('api/token/revoke/', TokenRevokeView.as_view(), name='token_revoke'),
 
     # User registration endpoints
     path('api/siteusers/register/', SiteUserRegisterView.as_view(), name='siteuser_register'),  # New endpoint
@@ -1,3 +1,6 @@
+import hashlib
+import unicodedata
+
 from django.core import signing
 from django.core.mail import send_mail
 from django.conf import settings
@@ -6,6 +9,31 @@ from django.utils import timezone
 from django.utils.http import int_to_base36, base36_to_int
 from urllib.parse import urlencode
 
+# ------------------------
+# Search folding
+# ------------------------
+
+# letters NFKD leaves whole; å, é, ü etc. lose their marks on decomposition
+SEARCH_FOLD = str.maketrans({'æ': 'ae', 'ø': 'o', 'đ': 'd', 'ł': 'l', 'ĸ': 'q'})
+
+
+def fold_search_text(value):
+    """Case- and diacritic-folded form of `value` for the indexed search columns."""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.translate(SEARCH_FOLD).split())
+
+
+def patient_identity_key(name, last_name, day_of_birth):
+    """Hash of the folded name, last name and birth date; None without a birth date (not identifying)."""
+    if not day_of_birth:
+        return None
+    identity = f'{fold_search_text(name)}|{fold_search_text(last_name)}|{day_of_birth.isoformat()}'
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
 # ------------------------
 # Password Reset Tokens
 # ------------------------
@@ -1,23 +1,67 @@
 # dgp_bus/views.py
 from rest_framework import viewsets, status, generics
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.decorators import permission_classes, action, api_view
+from rest_framework.decorators import permission_classes, renderer_classes, action, api_view
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
-
-from .models import Hospital, Schedule, Patient, Appointment, Accommodation, SiteUser as SiteUserModel
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch, Sum
+
+from .models import (
+    Hospital, Schedule, Patient, Appointment, AppointmentTombstone, Accommodation, RideRun, RidershipDay,
+    SiteUser as SiteUserModel,
+)
 from .serializers import (
-    HospitalSerializer, ScheduleSerializer, PatientSerializer,
+    HospitalSerializer, ScheduleSerializer, PatientSerializer, PatientWithAppointmentsSerializer,
     AppointmentSerializer, AppointmentPublicSerializer,
     StaffAdminUserSerializer, RegisterUserSerializer, ApproveUserSerializer,
     AccommodationSerializer, SiteUserSerializer,
     SiteUserPasswordResetRequestSerializer, SiteUserPasswordResetConfirmSerializer,
     SiteUserInviteSerializer, SiteUserInviteConfirmSerializer,
-    BusTimeInputSerializer,
+    BusTimeInputSerializer, RideRunSerializer, TokenRevokeSerializer, CheckInSerializer,
+    parse_pk,
 )
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from .utils import site_user_password_reset_token, send_password_reset_email, timezone
+from .rides import build_ride_runs, horizon
+from .planner import plan_days
+from .revisions import get_revisions, day_scope
+from .conditional import conditional
+from .idempotency import idempotent
+from .bulk import save_appointments
+from .checkin import check_in, set_flag
+from .db_router import on_replica, replica_reads
+from .reference import reference_rows
+from .throttling import TokenBucketThrottle
+from .renderers import BOARD_RENDERERS, wants_columnar
+from .authentication import revoke_token
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+
+# appointments/changes cursors count microseconds from here
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# what appointment responses embed besides the appointments themselves
+APPOINTMENT_SCOPES = ('appointments', 'patients', 'hospitals', 'accommodations')
+
+
+def appointment_day_scopes(*days):
+    return (*(day_scope('appointments', day) for day in days), 'patients', 'hospitals', 'accommodations')
+
+
+def upcoming_appointment_scopes(view, request):
+    # lists that start today also change at midnight; today's scope is new then
+    return ('appointments', *appointment_day_scopes(date.today()))
+
+
+def patient_scopes(view, request):
+    if view.expand_appointments():
+        return upcoming_appointment_scopes(view, request)
+    return ('patients',)
 
 
 @api_view(['GET'])
@@ -31,9 +75,35 @@ class AccommodationViewSet(viewsets.ModelViewSet):
     serializer_class = AccommodationSerializer
     permission_classes = [AllowAny]
 
+    @conditional(('accommodations',))
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_serializer(reference_rows(Accommodation), many=True).data)
+
+
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    # each attempt costs a PBKDF2 check; limit per IP and per account email
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'token'
+
+
+class TokenRevokeView(APIView):
+    """Log out: deny the access token of this request and, if given, the refresh token."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = TokenRevokeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.auth is not None:
+            revoke_token(request.auth)
+        if serializer.validated_data.get('refresh') is not None:
+            revoke_token(serializer.validated_data['refresh'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class SiteUserRegisterView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'signup'
     def post(self, request, *args, **kwargs):
         serializer = SiteUserSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -45,6 +115,8 @@ class SiteUserRegisterView(APIView):
 # Password reset request view
 class SiteUserPasswordResetRequestView(generics.GenericAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'password_reset'
     serializer_class = SiteUserPasswordResetRequestSerializer
 
     def post(self, request):
@@ -58,6 +130,8 @@ class SiteUserPasswordResetRequestView(generics.GenericAPIView):
 # Password reset confirm view
 class SiteUserPasswordResetConfirmView(generics.GenericAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'password_reset'
     serializer_class = SiteUserPasswordResetConfirmSerializer
 
     def post(self, request):
@@ -69,6 +143,8 @@ class SiteUserPasswordResetConfirmView(generics.GenericAPIView):
 # Password reset validation view
 class SiteUserPasswordResetValidateView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'password_reset'
 
     def post(self, request):
         from .utils import verify_signed_reset_data
@@ -100,6 +176,8 @@ class SiteUserInviteView(generics.GenericAPIView):
 
 class SiteUserInviteConfirmView(generics.GenericAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'signup'
     serializer_class = SiteUserInviteConfirmSerializer
 
     def post(self, request):
@@ -113,6 +191,8 @@ class PatientViewSet(viewsets.ModelViewSet):
     serializer_class = PatientSerializer
     parser_classes = [JSONParser]
     permission_classes = [IsAuthenticated]  # default for all other actions
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scopes = {'create': 'public_create'}
 
     def get_permissions(self):
         # allow anonymous create; everything else requires staff
@@ -128,12 +208,63 @@ class PatientViewSet(viewsets.ModelViewSet):
             return []
         return super().get_authenticators()
 
-    # (optional) keep explicit create for logging
+    def expand_appointments(self):
+        """?expand=appointments on list/retrieve: each patient with their upcoming appointments."""
+        if getattr(self, 'action', None) not in {'list', 'retrieve'}:
+            return False
+        return 'appointments' in self.request.query_params.get('expand', '').split(',')
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.expand_appointments():
+            # one query for every patient's appointments, whatever the number of patients
+            upcoming = (
+                Appointment.objects.filter(appointment_date__gte=date.today())
+                .select_related('hospital', 'accommodation')
+                .order_by('appointment_date', 'appointment_time')
+            )
+            qs = qs.prefetch_related(Prefetch('appointments', queryset=upcoming, to_attr='upcoming_appointments'))
+        return qs
+
+    def get_serializer_class(self):
+        if self.expand_appointments():
+            return PatientWithAppointmentsSerializer
+        return super().get_serializer_class()
+
+    @conditional(patient_scopes)
+    @on_replica
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """Patients whose first or last name starts with each word of ?q=, case- and accent-insensitive."""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 25)), 1), 100)
+        except ValueError:
+            return Response({'error': 'Invalid limit parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not query.strip():
+            return Response({'error': 'q is a required parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.PATIENT_SEARCH_FULLTEXT and connection.vendor == 'mysql':
+            qs = Patient.objects.fulltext_search(query)
+        else:
+            qs = Patient.objects.search(query)
+        qs = qs.order_by('search_name', 'search_last_name')[:limit]
+        return Response(PatientSerializer(qs, many=True).data)
+
+    # returning patients are linked to their existing record instead of a duplicate; anonymous
+    # callers only get its id back, not what else is stored about them
+    @idempotent
     def create(self, request, *args, **kwargs):
         print("Creating patient (public):", request.data)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        patient, created = Patient.objects.update_or_create_identity(**serializer.validated_data)
+        if not created:
+            return Response({'id': patient.id}, status=status.HTTP_201_CREATED)
+        serializer.instance = patient
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -143,6 +274,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
     parser_classes = [JSONParser]
     permission_classes = [IsAuthenticated]  # default
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scopes = {'create': 'public_create', 'calculate_bus_time': 'bus_time'}
 
     def get_permissions(self):
         public_actions = {
@@ -166,7 +299,44 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             return []  # no auth schemes -> no CSRF for anonymous POSTs
         return super().get_authenticators()
 
+    # read actions that take ?fields=, with the columns the action reads itself besides the rendered ones
+    SPARSE_ACTIONS = {
+        'list': (), 'retrieve': (), 'future_appointments': (), 'translator_view': (), 'taxi_users_view': (),
+        'find_patient': (),
+        'rides_today': ('appointment_time', 'bus_time_manual', 'bus_time_computed'),  # sort key
+        'changes': ('updated_at', 'appointment_date'),
+    }
+
+    def sparse_fields(self):
+        """?fields=a,b on a read action: the AppointmentSerializer fields to render, or None for all."""
+        raw = self.request.query_params.get('fields') if getattr(self, 'action', None) in self.SPARSE_ACTIONS else None
+        if not raw:
+            return None
+        names = [name.strip() for name in raw.split(',') if name.strip()]
+        unknown = set(names) - set(AppointmentSerializer.readable_fields())
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}."})
+        return names
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        fields = self.sparse_fields()
+        if fields is not None:
+            # fetch just the columns (and joins) the requested fields read
+            columns = [*AppointmentSerializer(fields=fields).only_columns(), *self.SPARSE_ACTIONS[self.action]]
+            relations = {column.split('__')[0] for column in columns if '__' in column}
+            qs = qs.select_related(None)
+            if relations:
+                qs = qs.select_related(*relations)
+            qs = qs.only(*columns)
+        return qs
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
     # Optional: keep explicit create for logging; not required
+    @idempotent
     def create(self, request, *args, **kwargs):
         print("Creating appointment (public):", request.data)
         serializer = self.get_serializer(data=request.data)
@@ -175,8 +345,38 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @conditional(APPOINTMENT_SCOPES)
+    @on_replica
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[IsAuthenticated])
+    @idempotent
+    def bulk(self, request):
+        """
+        Create (or, for items with an `id`, update) a list of appointments in one transaction.
+        Invalid items are reported per item and skipped, unless ?atomic=true.
+        """
+        items = request.data.get('appointments') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Expected a non-empty list of appointments.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.APPOINTMENT_BULK_MAX_ITEMS:
+            return Response({'error': f'At most {settings.APPOINTMENT_BULK_MAX_ITEMS} appointments per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        atomic = request.query_params.get('atomic', '').lower() in ('1', 'true', 'yes')
+        results, ok = save_appointments(items, atomic=atomic)
+        if ok:
+            return Response({'results': results}, status=status.HTTP_200_OK)
+        # atomic: nothing was written; otherwise the valid items were
+        return Response({'results': results},
+                        status=status.HTTP_400_BAD_REQUEST if atomic else status.HTTP_207_MULTI_STATUS)
+
     # -------- Public reads --------
-    @action(detail=False, methods=['get'], url_path='rides-today', permission_classes=[AllowAny])
+    @action(detail=False, methods=['get'], url_path='rides-today', permission_classes=[AllowAny],
+            renderer_classes=BOARD_RENDERERS)
+    @conditional(lambda view, request: appointment_day_scopes(date.today()))
+    @on_replica
     def rides_today(self, request):
         today = date.today()
         appts = self.get_queryset().filter(appointment_date=today)
@@ -187,17 +387,18 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 a.appointment_time,
             ),
         )
-        data = AppointmentSerializer(appts, many=True).data
+        data = self.get_serializer(appts, many=True).data
         print("Rides today response:", data)
-        return Response(AppointmentSerializer(appts, many=True).data)
+        return Response(data)
 
     @action(detail=False, methods=['get'], url_path='public-taxi-users', permission_classes=[AllowAny])
+    @conditional(lambda view, request: appointment_day_scopes(date.today(), date.today() + timedelta(days=1)))
+    @on_replica
     def public_taxi_users_view(self, request):
         today = date.today()
         tomorrow = today + timedelta(days=1)
-        qs = self.get_queryset().filter(appointment_date__range=[today, tomorrow])
-        appts = [a for a in qs if not (a.bus_time_manual or a.bus_time_computed)]
-        return Response(AppointmentPublicSerializer(appts, many=True).data)
+        qs = self.get_queryset().without_bus_time().filter(appointment_date__range=[today, tomorrow])
+        return Response(AppointmentPublicSerializer(qs, many=True).data)
 
     @action(detail=False, methods=['post'], url_path='calculate-bus-time', permission_classes=[AllowAny])
     def calculate_bus_time(self, request):
@@ -212,70 +413,219 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         )
         return Response({'success': True, 'bus_time': bus_time}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['get'], url_path='freemarker-rides', permission_classes=[AllowAny])
+    @action(detail=False, methods=['get'], url_path='freemarker-rides', permission_classes=[AllowAny],
+            renderer_classes=BOARD_RENDERERS)
+    @conditional(lambda view, request: (day_scope('ride_runs', date.today()),))
+    @on_replica
     def freemarker_rides(self, request):
         today = date.today()
-        qs = self.get_queryset().filter(appointment_date=today)
-        qs = [a for a in qs if (a.bus_time_manual or a.bus_time_computed)]
+        runs = list(RideRun.objects.filter(date=today).only('departure_time', 'passengers'))
+        if not runs:
+            # manifest not built for today yet (e.g. right after deploy): group the appointments directly
+            runs = sorted(build_ride_runs(today), key=lambda run: (run.departure_time, run.departure_location))
         grouped = {}
-        for a in qs:
-            key = (a.bus_time_manual or a.bus_time_computed).strftime('%H:%M')
-            grouped.setdefault(key, []).append({
-                "name": a.patient.name,
-                "room": a.patient.room,
-            })
+        for run in runs:
+            key = run.departure_time.strftime('%H:%M')
+            grouped.setdefault(key, []).extend(
+                {"name": p['name'], "room": p['room']} for p in run.passengers
+            )
+        if wants_columnar(request):
+            # one row per patient; the departure time becomes a column
+            return Response([{"departure_time": t, **p} for t, plist in grouped.items() for p in plist])
         result = [{"departure_time": t, "patients": plist} for t, plist in grouped.items()]
         return Response(result)
 
     # -------- Staff-only --------
     @action(
         detail=False, methods=['get'], url_path='alle-aftaler',
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated], renderer_classes=BOARD_RENDERERS
     )
+    @conditional(upcoming_appointment_scopes)
     def future_appointments(self, request):
         print("DEBUG alle-aftaler HIT")
         today = date.today()
         qs = self.get_queryset().filter(appointment_date__gte=today).order_by('appointment_date', 'appointment_time')
-        return Response(AppointmentSerializer(qs, many=True).data, status=status.HTTP_200_OK)
+        return Response(self.get_serializer(qs, many=True).data, status=status.HTTP_200_OK)
     
+    @action(
+        detail=False, methods=['get'], url_path='changes',
+        permission_classes=[IsAuthenticated]
+    )
+    def changes(self, request):
+        """
+        Delta sync for alle-aftaler: upcoming appointments created, modified or deleted since
+        ?since=<cursor>, oldest change first; without a cursor, all of them. Clients apply the
+        changes in order (upsert or drop by id), drop past days themselves and send the
+        returned cursor next time. Changes near the cursor may arrive twice. A row edited
+        into the past comes as a deletion.
+
+        Changes are ordered by updated_at, stamped at save time, not at commit: a write
+        whose transaction stays open longer than APPOINTMENT_CHANGES_SETTLE_SECONDS can
+        commit behind a cursor already handed out and is then missed.
+        """
+        now = timezone.now()
+        today = date.today()
+        qs = self.get_queryset()
+        tombstones = AppointmentTombstone.objects.none()
+
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since = CURSOR_EPOCH + timedelta(microseconds=int(since))
+            except (ValueError, OverflowError):
+                return Response({'error': 'Invalid since parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+            if since < now - timedelta(days=settings.APPOINTMENT_TOMBSTONE_DAYS):
+                # deletions that old are forgotten; start over from a full list
+                return Response({'error': 'Cursor expired, reload without since.'}, status=status.HTTP_410_GONE)
+            # whatever the date: an appointment moved into the past has to leave the client's list
+            qs = qs.filter(updated_at__gt=since)
+            tombstones = AppointmentTombstone.objects.filter(deleted_at__gt=since, appointment_date__gte=today)
+        else:
+            qs = qs.filter(appointment_date__gte=today)
+
+        appointments = list(qs)
+        upcoming = [a for a in appointments if a.appointment_date >= today]
+        changes = sorted(
+            [(a.updated_at, a.id, {'id': a.id, 'appointment': data})
+             for a, data in zip(upcoming, self.get_serializer(upcoming, many=True).data)]
+            + [(a.updated_at, a.id, {'id': a.id, 'deleted': True})
+               for a in appointments if a.appointment_date < today]
+            + [(deleted_at, appointment_id, {'id': appointment_id, 'deleted': True})
+               for appointment_id, deleted_at in tombstones.values_list('appointment_id', 'deleted_at')],
+            key=lambda change: change[:2],
+        )
+        # a transaction still open now may commit rows stamped slightly earlier; the next poll re-reads them
+        cursor = now - timedelta(seconds=settings.APPOINTMENT_CHANGES_SETTLE_SECONDS)
+        return Response({
+            'cursor': str((cursor - CURSOR_EPOCH) // timedelta(microseconds=1)),
+            'changes': [change for *_, change in changes],
+        })
+
     @action(
         detail=False, methods=['get'], url_path='translator-view',
         permission_classes=[IsAuthenticated]
     )
+    @conditional(upcoming_appointment_scopes)
     def translator_view(self, request):
         today = date.today()
         end_date = today + timedelta(days=5)
-        qs = (
-            self.get_queryset()
-            .filter(translator=True, appointment_date__range=[today, end_date])
-            .order_by('appointment_date', 'appointment_time')
-        )
-        return Response(AppointmentSerializer(qs, many=True).data)
+        qs = self.get_queryset().for_translators(today, end_date)
+        return Response(self.get_serializer(qs, many=True).data)
 
     @action(
         detail=False, methods=['get'], url_path='taxi-users',
         permission_classes=[IsAuthenticated]
         )
+    @conditional(upcoming_appointment_scopes)
     def taxi_users_view(self, request):
         today = date.today()
         horizon = today + timedelta(days=120)
-        qs = self.get_queryset().filter(appointment_date__range=[today, horizon])
-        appts = [a for a in qs if not (a.bus_time_manual or a.bus_time_computed)]
-        return Response(AppointmentSerializer(appts, many=True).data)
+        qs = self.get_queryset().without_bus_time().filter(appointment_date__range=[today, horizon])
+        return Response(self.get_serializer(qs, many=True).data)
+
+    @action(
+        detail=False, methods=['get'], url_path='ride-runs',
+        permission_classes=[IsAuthenticated]
+    )
+    @conditional(lambda view, request: ('ride_runs', day_scope('ride_runs', date.today()), 'hospitals'))
+    def ride_runs(self, request):
+        """Precomputed departures from ?date= (default today) for ?days= days, within the manifest horizon."""
+        start, end = horizon()
+        try:
+            first = date.fromisoformat(request.query_params['date']) if 'date' in request.query_params else start
+            days = int(request.query_params.get('days', 1))
+        except ValueError:
+            return Response({'error': 'Invalid date or days parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        last = min(first + timedelta(days=max(days, 1) - 1), end)
+        qs = RideRun.objects.select_related('destination').filter(date__range=[first, last])
+        return Response(RideRunSerializer(qs, many=True).data)
+
+    @action(
+        detail=False, methods=['get'], url_path='bus-plan',
+        permission_classes=[IsAuthenticated]
+    )
+    def bus_plan(self, request):
+        """Vehicle assignment for ?date= (default today) and ?days= days, with spills and taxi flags."""
+        try:
+            first = date.fromisoformat(request.query_params['date']) if 'date' in request.query_params else date.today()
+            days = min(max(int(request.query_params.get('days', 1)), 1), 31)
+        except ValueError:
+            return Response({'error': 'Invalid date or days parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(plan_days(first, days))
+
+    @action(
+        detail=False, methods=['get'], url_path='load-forecast',
+        permission_classes=[IsAuthenticated]
+    )
+    def load_forecast(self, request):
+        """Passengers, wheelchairs and trolleys per departure for the next ?days= days (default 14)."""
+        try:
+            days = min(max(int(request.query_params.get('days', 14)), 1), settings.LOAD_FORECAST_MAX_DAYS)
+        except ValueError:
+            return Response({'error': 'Invalid days parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        today = date.today()
+
+        # keyed per day and per appointment/timetable revision, so any change starts a new entry
+        cache_key = 'load-forecast:{}:{}:{}:{}'.format(today, days, *get_revisions('appointments', 'schedules'))
+        data = cache.get(cache_key)
+        if data is None:
+            rows = (
+                Appointment.objects
+                .filter(appointment_date__range=[today, today + timedelta(days=days - 1)])
+                .departure_loads()
+            )
+            data = [
+                {
+                    'date': r['appointment_date'],
+                    'departure_time': r['bus_time'].strftime('%H:%M'),
+                    'destination_id': r['destination_id'],
+                    'departure_location': r['departure_location'],
+                    'passengers': r['passengers'],
+                    'wheelchairs': r['wheelchairs'],
+                    'trolleys': r['trolleys'],
+                    'companions': r['companions'],
+                }
+                for r in rows
+            ]
+            cache.set(cache_key, data, timeout=24 * 60 * 60)
+        return Response(data)
+
+    def _set_flag(self, request, pk, field):
+        """(pk, new value, None) or (None, None, error response)."""
+        pk = parse_pk(Appointment, pk)
+        if pk is None:
+            return None, None, Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        # {"<field>": true/false} sets the value the clerk saw change; an empty body flips it
+        value = request.data.get(field) if isinstance(request.data, dict) else None
+        if value is not None and not isinstance(value, bool):
+            return None, None, Response({'error': f'{field} must be true or false.'}, status=status.HTTP_400_BAD_REQUEST)
+        value = set_flag(pk, field, value)
+        if value is None:
+            return None, None, Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return pk, value, None
 
     @action(detail=True, methods=['patch'], url_path='toggle-status')
     def toggle_status(self, request, pk=None):
-        appt = self.get_object()
-        appt.status = not appt.status
-        appt.save(update_fields=['status'])
-        return Response({'id': appt.id, 'status': appt.status}, status=status.HTTP_200_OK)
+        pk, value, error = self._set_flag(request, pk, 'status')
+        if error:
+            return error
+        return Response({'id': pk, 'status': value}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['patch'], url_path='toggle-taxi')
     def toggle_taxi(self, request, pk=None):
-        appt = self.get_object()
-        appt.has_taxi = not appt.has_taxi
-        appt.save(update_fields=['has_taxi'])
-        return Response({'has_taxi': appt.has_taxi}, status=status.HTTP_200_OK)
+        _, value, error = self._set_flag(request, pk, 'has_taxi')
+        if error:
+            return error
+        return Response({'has_taxi': value}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='check-in')
+    def bulk_check_in(self, request):
+        """Set status for {"ids": [...]} or for a whole departure {"date", "departure_time"} in one UPDATE."""
+        ser = CheckInSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        v = ser.validated_data
+        updated = check_in(v['status'], ids=v.get('ids'), day=v.get('date'), departure_time=v.get('departure_time'))
+        return Response({'status': v['status'], 'updated': updated}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'], url_path='find-patient')
     def find_patient(self, request):
@@ -286,14 +636,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if not (name and room and accommodation):
             return Response({'error': 'Name, room, and accommodation are required parameters.'},
                             status=status.HTTP_400_BAD_REQUEST)
-        qs = self.get_queryset().filter(
-            patient__name=name,
-            patient__room=room,
-            accommodation__name=accommodation,
-            appointment_date__gte=today,
-        ).order_by('appointment_date', 'appointment_time')
+        qs = (
+            self.get_queryset()
+            .for_patient(name, room, accommodation)
+            .filter(appointment_date__gte=today)
+            .order_by('appointment_date', 'appointment_time')
+        )
         if qs.exists():
-            return Response(AppointmentSerializer(qs, many=True).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(qs, many=True).data, status=status.HTTP_200_OK)
         return Response({'message': 'No matching patient found with a future appointment.'},
                         status=status.HTTP_404_NOT_FOUND)
 
@@ -301,6 +651,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@renderer_classes(BOARD_RENDERERS)
 def get_today_rides(request):
     from datetime import date
     from .models import Appointment
@@ -310,6 +661,8 @@ def get_today_rides(request):
           .filter(appointment_date=today)
           .order_by('appointment_time'))
     rides = {}
+    with replica_reads(request):
+        qs = list(qs)
     for a in qs:
         bt = a.bus_time_manual or a.bus_time_computed
         key = bt.strftime('%H:%M') if bt else "Unknown"
@@ -323,15 +676,68 @@ def get_today_rides(request):
             "status": a.status,
             "checked_in": False,
         })
+    if wants_columnar(request):
+        # the rows already carry bus_time, so the grouping is a column
+        return Response([row for rows in rides.values() for row in rows])
     return Response({"rides": rides})
 
+class RidershipView(APIView):
+    """
+    Ridership analytics from the daily rollup table, so cost doesn't grow with the raw appointments.
+    Filters: date_from, date_to (default the last 90 days), hospital, accommodation, weekday (1 = Monday).
+    group_by: comma separated subset of date, weekday, hospital, accommodation, departure_time.
+    """
+    permission_classes = [IsAuthenticated]
+
+    GROUPABLE = {
+        'date': 'date',
+        'weekday': 'weekday',
+        'hospital': 'hospital_id',
+        'accommodation': 'accommodation_id',
+        'departure_time': 'departure_time',
+    }
+    COUNTS = ('appointments', 'checked_in', 'wheelchair', 'trolley', 'companion', 'translator', 'taxi')
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            date_to = date.fromisoformat(params['date_to']) if 'date_to' in params else date.today()
+            date_from = date.fromisoformat(params['date_from']) if 'date_from' in params else date_to - timedelta(days=90)
+            filters = {'date__range': [date_from, date_to]}
+            for name in ('hospital', 'accommodation', 'weekday'):
+                if name in params:
+                    filters[self.GROUPABLE[name]] = int(params[name])
+        except ValueError:
+            return Response({'error': 'Invalid filter parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        group_by = [g for g in params.get('group_by', 'date').split(',') if g]
+        unknown = [g for g in group_by if g not in self.GROUPABLE]
+        if unknown:
+            return Response({'error': f'Cannot group by: {", ".join(unknown)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        columns = [self.GROUPABLE[g] for g in group_by]
+        rows = (
+            RidershipDay.objects
+            .filter(**filters)
+            .values(*columns)
+            .annotate(**{f'total_{c}': Sum(c) for c in self.COUNTS})
+            .order_by(*columns)
+        )
+        data = [
+            {**{g: r[c] for g, c in zip(group_by, columns)}, **{c: r[f'total_{c}'] for c in self.COUNTS}}
+            for r in rows
+        ]
+        return Response(data)
+
+
 class HospitalViewSet(viewsets.ModelViewSet):
     queryset = Hospital.objects.all()
     serializer_class = HospitalSerializer
     permission_classes = [AllowAny]
 
+    @conditional(('hospitals',))
     def list(self, request):
-        hospitals = self.get_queryset()
+        hospitals = reference_rows(Hospital)
         serializer = self.get_serializer(hospitals, many=True)
         return Response(serializer.data)
 
@@ -340,8 +746,9 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     queryset = Schedule.objects.all()
     serializer_class = ScheduleSerializer
 
+    @conditional(('schedules',))
     def list(self, request):
-        schedules = self.get_queryset()
+        schedules = reference_rows(Schedule)
         serializer = self.get_serializer(schedules, many=True)
         return Response(serializer.data)
 
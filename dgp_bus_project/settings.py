@@ -1,6 +1,8 @@
 from pathlib import Path
 from datetime import timedelta
 from decouple import config, Csv
+from celery.schedules import crontab
+from corsheaders.defaults import default_headers
 import os
 from dotenv import load_dotenv
 load_dotenv()  # only if you're not already loading dotenv
@@ -63,10 +65,30 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'dgp_bus.db_router.ReplicaPinMiddleware',
 ]
 
 # Celery setup 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
+
+# Cache on the same Redis server (separate db); CACHE_URL=locmem:// for local testing
+CACHE_URL = config('CACHE_URL', default='redis://localhost:6379/1')
+if CACHE_URL.startswith('redis://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# How long a process trusts its in-memory copy of the hospitals/accommodations/schedules
+# before checking their revision in the cache (dgp_bus.reference)
+REFERENCE_CACHE_LOCAL_SECONDS = 2
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -88,13 +110,80 @@ CELERY_TASK_ROUTES = {
     'dgp_bus.taxi_email.send_taxi_user_report': {'queue': 'dgp_bus_taxi'},
     'dgp_bus.mailgun_tasks.send_smtp_email': {'queue': 'dgp_bus_taxi'},  # Emails are tied to taxi report
     'dgp_bus.tasks.delete_expired_entries': {'queue': 'dgp_bus_cleanup'},
+    'dgp_bus.tasks.rebuild_ride_runs': {'queue': 'dgp_bus_cleanup'},
+    'dgp_bus.tasks.rollup_ridership': {'queue': 'dgp_bus_cleanup'},
+    'dgp_bus.tasks.archive_appointments': {'queue': 'dgp_bus_cleanup'},
+    'dgp_bus.tasks.maintain_appointment_partitions': {'queue': 'dgp_bus_cleanup'},
+}
+
+# Code-defined periodic tasks; the DatabaseScheduler installs these on startup
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-ride-runs-nightly': {
+        'task': 'dgp_bus.tasks.rebuild_ride_runs',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'rollup-ridership-nightly': {
+        'task': 'dgp_bus.tasks.rollup_ridership',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'archive-appointments-nightly': {
+        'task': 'dgp_bus.tasks.archive_appointments',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'maintain-appointment-partitions-nightly': {
+        'task': 'dgp_bus.tasks.maintain_appointment_partitions',
+        'schedule': crontab(hour=3, minute=30),
+    },
 }
 
+# Days ahead (besides today) kept in the RideRun manifest
+RIDE_RUN_DAYS = 7
+# timetable/hospital/accommodation changes rebuild the manifest in Celery this many seconds later,
+# once for all changes in between
+RIDE_RUN_REBUILD_DELAY = 30
+
+# Finished days rolled up again on every ridership rollup (late check-ins, taxi flags)
+RIDERSHIP_REFRESH_DAYS = 3
+
+# Appointment archive: gzip JSONL files per day, see dgp_bus.archive
+APPOINTMENT_ARCHIVE_DIR = config('APPOINTMENT_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'appointments'))
+APPOINTMENT_ARCHIVE_AFTER_DAYS = config('APPOINTMENT_ARCHIVE_AFTER_DAYS', default=14, cast=int)
+APPOINTMENT_ARCHIVE_BATCH_SIZE = 500
+
+# Months ahead kept as ready partitions once the appointment table is partitioned (MySQL only)
+APPOINTMENT_PARTITION_MONTHS_AHEAD = 5
+
+# Serve /api/patients/search/ from the FULLTEXT index on MySQL (migration 0013); prefix ranges otherwise
+PATIENT_SEARCH_FULLTEXT = config('PATIENT_SEARCH_FULLTEXT', default=False, cast=bool)
+
+# Idempotency-Key: how long a first response is replayed, and how long a request may hold its key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# Delta sync (appointments/changes): rows changed within the settle window are sent again on the
+# next poll, in case a slower transaction commits behind them. A write whose transaction stays open
+# longer than that (rows are stamped at save, not at commit) can be missed. Tombstones older than the
+# retention are purged, and clients with an older cursor are told to resync
+APPOINTMENT_CHANGES_SETTLE_SECONDS = 5
+APPOINTMENT_TOMBSTONE_DAYS = 30
+
+# Largest list POST /api/appointments/bulk/ accepts
+APPOINTMENT_BULK_MAX_ITEMS = 500
+
+# Longest horizon the load forecast endpoint serves
+LOAD_FORECAST_MAX_DAYS = 120
+
+# Vehicles available for every departure, used by the bus planner
+BUS_VEHICLES = [
+    {'name': 'Bus 1', 'seats': 8, 'wheelchairs': 1, 'trolleys': 2},
+]
+
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',  # Default for admin/staff
-    'dgp_bus.backends.SiteUserBackend',  # Custom backend for site users
+    'dgp_bus.backends.AccountBackend',  # Staff and site users in one query
 ]
+# Seconds an unknown login email is remembered by AccountBackend
+AUTH_NEGATIVE_CACHE_TIMEOUT = 60
 
 BASE_URL = os.getenv("BASE_URL", "https://bus.patienthjem.dk")
 INVITE_TOKEN_EXPIRY = 24 * 60 * 60
@@ -114,15 +203,33 @@ AUTH_USER_MODEL = 'dgp_bus.StaffAdminUser'
 
 # Cross-origin resource sharing (CORS) settings
 CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', cast=Csv())
+# tablets send Idempotency-Key on public creates, see dgp_bus.idempotency
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'ETag']
 
 # REST framework settings, including JWT authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'dgp_bus.authentication.TokenClaimsAuthentication',  # request.user from token claims, no DB query
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',  # Only restrict specific views
     ),
+    # client IP for the per-IP throttles and replica pinning: the address the last NUM_PROXIES
+    # reverse proxies saw. Set it to the number of proxies in front of gunicorn (0 if clients connect
+    # directly); otherwise clients pick their own X-Forwarded-For and dodge the limits
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1')),
+    # token buckets for dgp_bus.throttling.TokenBucketThrottle: '<scope>.ip' / '<scope>.account',
+    # 'N/period' = bursts of N, refilled at N per period
+    'DEFAULT_THROTTLE_RATES': {
+        'bus_time.ip': '60/min',
+        'public_create.ip': '30/min',
+        'token.ip': '20/min',
+        'token.account': '5/min',
+        'password_reset.ip': '10/hour',
+        'password_reset.account': '3/hour',
+        'signup.ip': '10/hour',
+    },
 }
 
 # JWT settings
@@ -130,6 +237,10 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # tokens carry user_type/role/is_staff/is_active claims, see dgp_bus.authentication
+    'TOKEN_OBTAIN_SERIALIZER': 'dgp_bus.serializers.CustomTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'dgp_bus.serializers.CustomTokenRefreshSerializer',
+    'TOKEN_USER_CLASS': 'dgp_bus.authentication.AccountTokenUser',
 }
 
 # Root URL configuration
@@ -156,16 +267,47 @@ TEMPLATES = [
 WSGI_APPLICATION = 'dgp_bus_project.wsgi.application'
 
 # Database settings
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',  
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT', default='3306'),
+# DB_ENGINE=sqlite runs on a local SQLite file for testing (no table partitioning there)
+if config('DB_ENGINE', default='mysql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',  
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT', default='3306'),
+        }
+    }
+
+# Optional read replica for the public boards, list endpoints, exports and the taxi report
+# (dgp_bus.db_router). DB_REPLICA_HOST adds a MySQL replica; with DB_ENGINE=sqlite,
+# DB_REPLICA_NAME points at a second SQLite file standing in for one.
+if config('DB_ENGINE', default='mysql') == 'sqlite':
+    if config('DB_REPLICA_NAME', default=''):
+        DATABASES['replica'] = {**DATABASES['default'], 'NAME': config('DB_REPLICA_NAME')}
+elif config('DB_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': config('DB_REPLICA_HOST'),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+    }
+if 'replica' in DATABASES:
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['dgp_bus.db_router.PrimaryReplicaRouter']
+DB_REPLICA_MAX_LAG = 5  # seconds; a lagging replica is skipped
+DB_REPLICA_PIN_SECONDS = 10  # primary-only reads after a client writes; keep above DB_REPLICA_MAX_LAG
+DB_REPLICA_CHECK_INTERVAL = 10  # seconds between replica health/lag checks
 
 # Password validation settings
 AUTH_PASSWORD_VALIDATORS = [
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
+from dgp_bus.views import ThrottledTokenObtainPairView
 
 urlpatterns = [
     path('admin/', admin.site.urls),  # Admin routes
@@ -9,6 +10,6 @@ urlpatterns = [
     path('', include('dgp_bus.urls')),  # Delegates to app-level urls
 
     # JWT Token authentication endpoints (can keep these if needed)
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # Endpoint for obtaining JWT
+    path('api/token/', ThrottledTokenObtainPairView.as_view(), name='token_obtain_pair'),  # Endpoint for obtaining JWT
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  # Endpoint for refreshing JWT
 ]